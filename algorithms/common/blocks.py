@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def block_grid_shape(shape, block_size, ragged=True):
+    """ Number of (rows, columns) of blocks, ragged counts the smaller blocks at the bottom and right edges """
+    height, width = shape[:2]
+    if ragged:
+        return -(-height // block_size), -(-width // block_size)
+    return height // block_size, width // block_size
+
+
+def block_stacks(image, block_size, ragged=True):
+    """ Splits a single channel image into at most four stacks of equally sized blocks
+
+    The stacks are the full blocks and, with ragged, the narrower blocks at the right edge, the shorter ones
+    at the bottom edge and the corner block, i.e. the same blocks as slicing
+    image[i:i + block_size, j:j + block_size] in a loop. Every stack is a contiguous
+    (block rows, block columns, block height, block width) copy, so a reduction over axes (2, 3)
+    sums in the same order as reducing each block on its own and gives bit-identical results.
+
+    Args:
+        image : image input with single channel
+        block_size (int): side of the blocks
+        ragged (bool, optional): include the smaller blocks at the edges, False drops the pixels
+            that don't fill a whole block. Defaults to True.
+
+    Returns:
+        : list of (grid rows slice, grid columns slice, stack) tuples
+    """
+    height, width = image.shape[:2]
+    rows, columns = height // block_size, width // block_size
+    full_height, full_width = rows * block_size, columns * block_size
+    row_parts = [(slice(0, rows), 0, full_height, block_size)]
+    column_parts = [(slice(0, columns), 0, full_width, block_size)]
+    if ragged and full_height < height:
+        row_parts.append((slice(rows, rows + 1), full_height, height, height - full_height))
+    if ragged and full_width < width:
+        column_parts.append((slice(columns, columns + 1), full_width, width, width - full_width))
+
+    stacks = []
+    for grid_rows, top, bottom, block_height in row_parts:
+        for grid_columns, left, right, block_width in column_parts:
+            if bottom == top or right == left:
+                continue
+            view = image[top:bottom, left:right].reshape(
+                (bottom - top) // block_height, block_height, (right - left) // block_width, block_width)
+            stacks.append((grid_rows, grid_columns, np.ascontiguousarray(view.transpose(0, 2, 1, 3))))
+    return stacks
+
+
+def block_reduce(image, block_size, reduction, ragged=True, dtype=None):
+    """ Applies reduction(stack, axis=(2, 3)) to every block, see block_stacks
+
+    Returns:
+        : (block rows, block columns) array with one value per block, empty if there is no block
+            (e.g. without ragged for an image smaller than one block)
+    """
+    grid = None
+    for grid_rows, grid_columns, stack in block_stacks(image, block_size, ragged):
+        values = reduction(stack, axis=(2, 3))
+        if grid is None:
+            grid = np.empty(block_grid_shape(image.shape, block_size, ragged), dtype=dtype or values.dtype)
+        grid[grid_rows, grid_columns] = values
+    if grid is None:
+        grid = np.empty(block_grid_shape(image.shape, block_size, ragged), dtype=dtype or image.dtype)
+    return grid
+
+
+def block_min(image, block_size, ragged=True):
+    return block_reduce(image, block_size, np.min, ragged)
+
+
+def block_max(image, block_size, ragged=True):
+    return block_reduce(image, block_size, np.max, ragged)
+
+
+def block_mean(image, block_size, ragged=True):
+    return block_reduce(image, block_size, np.mean, ragged, dtype=np.float64)
+
+
+def block_std(image, block_size, ragged=True):
+    return block_reduce(image, block_size, np.std, ragged, dtype=np.float64)
+
+
+def block_histograms(image, block_size, ragged=True):
+    """ 256 bin histogram of every block of a uint8 image, counted with one bincount per stack
+
+    Returns:
+        : (block rows, block columns, 256) int64 array
+    """
+    grid = np.zeros(block_grid_shape(image.shape, block_size, ragged) + (256,), dtype=np.int64)
+    for grid_rows, grid_columns, stack in block_stacks(image, block_size, ragged):
+        rows, columns = stack.shape[:2]
+        # every block counts into its own 256 bins
+        offsets = (np.arange(rows * columns) * 256).reshape(rows, columns, 1, 1)
+        counts = np.bincount((stack + offsets).ravel(), minlength=rows * columns * 256)
+        grid[grid_rows, grid_columns] = counts.reshape(rows, columns, 256)
+    return grid
+
+
+def histogram_entropy(hists):
+    """ Shannon entropy in bits of a 256 bin histogram or a stack of them with shape (..., 256)
+
+    Computed in float32 the way a cv2.calcHist histogram is, so a block's entropy matches
+    running shannon_entropy on the block itself.
+    """
+    hists = np.asarray(hists, dtype=np.float32)
+    # Compute probability of each intensity level
+    hists = hists / hists.sum(axis=-1, keepdims=True)
+    # Adding a small value to avoid log(0)
+    return -np.sum(hists * np.log2(hists + 1e-10), axis=-1)
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+# cv2.calcHist counts in float32, which is exact only up to 2 ** 24 pixels
+_MAX_CALCHIST_PIXELS = 2 ** 24
+
+
+def histogram(img):
+    """ Histogram of a single channel uint8 image
+
+    Args:
+        img : image input with single channel
+
+    Returns:
+        : int64 array with the count of each of the 256 intensities
+    """
+    array = np.asarray(img)
+    if array.dtype == np.uint8 and array.size <= _MAX_CALCHIST_PIXELS:
+        return cv2.calcHist([array], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+    return np.bincount(array.ravel(), minlength=256)
+
+
+def clip_histogram(bin_cont, clip_limit):
+    """ Contrast limiting of CLAHE, clips the bins and spreads the clipped counts evenly over all bins
+
+    Args:
+        bin_cont : histogram with 256 bins, or a stack of histograms with shape (..., 256)
+        clip_limit (float): the limit relative to the average bin count, e.g. 2.0 allows bins twice the average
+
+    Returns:
+        : float histogram(s) with the same total count
+    """
+    bin_cont = np.asarray(bin_cont, dtype=np.float64)
+    limit = np.maximum(clip_limit * bin_cont.sum(axis=-1, keepdims=True) / 256, 1)
+    clipped = np.minimum(bin_cont, limit)
+    excess = (bin_cont - clipped).sum(axis=-1, keepdims=True)
+    return clipped + excess / 256
+
+
+def equalization_lut(bin_cont):
+    """ Maps each intensity to its equalized value
+
+    Args:
+        bin_cont : histogram of the image, see histogram, or a stack of histograms with shape (..., 256)
+
+    Returns:
+        : uint8 lookup table with 256 entries, one per histogram for a stack
+    """
+    pixels = np.sum(bin_cont, axis=-1, keepdims=True)
+    bin_cont = bin_cont / pixels
+    cumulative_sumhist = np.cumsum(bin_cont, axis=-1)
+    return np.floor(255 * cumulative_sumhist).astype(np.uint8)
+
+
+def apply_lut(img, lut):
+    """ Replaces every pixel with its lookup table entry in a single vectorized pass """
+    array = np.asarray(img)
+    if array.dtype == np.uint8:
+        return cv2.LUT(array, lut)
+    return lut[array]
+
+
+def hist_equalization(img):
+    """ Normal Histogram Equalization
+
+    Args:
+        img : image input with single channel
+
+    Returns:
+        : Equalized Image
+    """
+    return apply_lut(img, equalization_lut(histogram(img)))
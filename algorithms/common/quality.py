@@ -0,0 +1,202 @@
+import threading
+
+import cv2
+import numpy as np
+
+from algorithms.common import blocks
+from algorithms.common.equalization import histogram
+from guimg.tiled import DEFAULT_BAND_BYTES, TiledImage
+
+# guards the statistics kept in the shared dicts, measures of the same image may run on several threads
+_shared_lock = threading.Lock()
+
+
+class ImageStatistics:
+    """ Intermediates the quality measures of one image share
+
+    The grayscale image, its histogram and the block statistics are computed on first use and reused
+    by every measure that needs them, so scoring an image with several measures costs about as much
+    as its most expensive measure.
+
+    Args:
+        image : BGR or single channel image
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self._cache = {}
+        # measures running concurrently wait for an intermediate another one is computing instead of repeating it
+        self._lock = threading.RLock()
+
+    @classmethod
+    def shared(cls, image, shared):
+        """ The statistics of image kept in shared, the dict of intermediates the pipeline keeps per image """
+        with _shared_lock:
+            statistics = shared.get('quality_statistics')
+            if statistics is None or statistics.image is not image:
+                statistics = shared['quality_statistics'] = cls.of(image)
+            return statistics
+
+    @classmethod
+    def of(cls, image):
+        """ TiledStatistics for a guimg.tiled.TiledImage, ImageStatistics for an image in memory """
+        return TiledStatistics(image) if isinstance(image, TiledImage) else cls(image)
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+            return self._cache[key]
+
+    @property
+    def gray(self):
+        if len(self.image.shape) == 2:
+            return self.image
+        return self._cached('gray', lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    def mean(self, gray=False):
+        return self._cached(('mean', gray), lambda: np.mean(self.gray if gray else self.image))
+
+    def std(self):
+        return self._cached('std', lambda: np.std(self.gray))
+
+    def histogram(self):
+        return self._cached('histogram', lambda: histogram(self.gray))
+
+    def block_min(self, block_size):
+        return self._cached(('block_min', block_size), lambda: blocks.block_min(self.gray, block_size))
+
+    def block_max(self, block_size):
+        return self._cached(('block_max', block_size), lambda: blocks.block_max(self.gray, block_size))
+
+    def block_std(self, block_size, ragged=True):
+        return self._cached(('block_std', block_size, ragged),
+                            lambda: blocks.block_std(self.gray, block_size, ragged))
+
+    def block_histograms(self, block_size, ragged=True):
+        return self._cached(('block_histograms', block_size, ragged),
+                            lambda: blocks.block_histograms(self.gray, block_size, ragged))
+
+    def block_entropies(self, block_size, ragged=True):
+        return self._cached(('block_entropies', block_size, ragged),
+                            lambda: blocks.histogram_entropy(self.block_histograms(block_size, ragged)))
+
+
+class TiledStatistics(ImageStatistics):
+    """ ImageStatistics of a guimg.tiled.TiledImage, computed band by band without loading the whole image
+
+    The bands of the block statistics are a whole number of blocks high, so every block lies in a single band
+    and gets exactly the value it gets in the whole image. The histogram is summed over the bands and the
+    global mean and deviation follow from integer sums, which matches numpy up to float rounding.
+
+    Args:
+        image (TiledImage): the image
+        band_bytes (int, optional): most bytes of the BGR band read at once, the block histograms of a band take
+            about eight times as much. Defaults to DEFAULT_BAND_BYTES / 4.
+    """
+
+    def __init__(self, image, band_bytes=DEFAULT_BAND_BYTES // 4):
+        super().__init__(image)
+        self.band_bytes = band_bytes
+
+    def _gray_bands(self, multiple=1):
+        for top, bottom in self.image.bands(multiple, self.band_bytes):
+            yield cv2.cvtColor(self.image.read(top, bottom), cv2.COLOR_BGR2GRAY)
+
+    def _block_grid(self, reduction, block_size, *args):
+        # bands too short for a whole block have no grid rows without ragged
+        return np.concatenate([reduction(gray, block_size, *args) for gray in self._gray_bands(block_size)])
+
+    @property
+    def gray(self):
+        raise TypeError("The grayscale image of a TiledImage isn't kept in memory, use the band statistics")
+
+    def mean(self, gray=False):
+        def compute():
+            if gray:
+                total = sum(int(band.sum(dtype=np.uint64)) for band in self._gray_bands())
+                return np.float64(total / (self.image.shape[0] * self.image.shape[1]))
+            total = sum(int(self.image.read(top, bottom).sum(dtype=np.uint64))
+                        for top, bottom in self.image.bands(max_bytes=self.band_bytes))
+            return np.float64(total / (self.image.shape[0] * self.image.shape[1] * 3))
+        return self._cached(('mean', gray), compute)
+
+    def std(self):
+        def compute():
+            counts = self.histogram()
+            intensities = np.arange(256)
+            mean = (counts * intensities).sum() / counts.sum()
+            return np.sqrt((counts * (intensities - mean) ** 2).sum() / counts.sum())
+        return self._cached('std', compute)
+
+    def histogram(self):
+        return self._cached('histogram', lambda: sum(histogram(band) for band in self._gray_bands()))
+
+    def block_min(self, block_size):
+        return self._cached(('block_min', block_size), lambda: self._block_grid(blocks.block_min, block_size))
+
+    def block_max(self, block_size):
+        return self._cached(('block_max', block_size), lambda: self._block_grid(blocks.block_max, block_size))
+
+    def block_std(self, block_size, ragged=True):
+        return self._cached(('block_std', block_size, ragged),
+                            lambda: self._block_grid(blocks.block_std, block_size, ragged))
+
+    def block_histograms(self, block_size, ragged=True):
+        return self._cached(('block_histograms', block_size, ragged),
+                            lambda: self._block_grid(blocks.block_histograms, block_size, ragged))
+
+    def block_entropies(self, block_size, ragged=True):
+        # reduced band by band, the histograms of all blocks take about 14 times the memory of the image
+        def entropies(gray, block_size, ragged):
+            return blocks.histogram_entropy(blocks.block_histograms(gray, block_size, ragged))
+        return self._cached(('block_entropies', block_size, ragged),
+                            lambda: self._block_grid(entropies, block_size, ragged))
+
+
+def ame(statistics, block_size=15, epsilon=1e-6, modified=False):
+    """ Average Michelson-based contrast measure over blocks of the grayscale image """
+    Imin = statistics.block_min(block_size).astype(np.float32)
+    Imax = statistics.block_max(block_size).astype(np.float32)
+
+    # Calculate A for every block
+    if modified:
+        A = epsilon + (Imax - Imin) / 255
+    else:
+        A = epsilon + (Imax - Imin) / (Imax + Imin + epsilon)
+
+    metric_values = (A * np.log(A)).ravel()
+
+    # Calculate the mean of metric values across all blocks
+    return np.abs(np.nanmean(metric_values))
+
+
+def mean_deviation(statistics, gray=False):
+    """ How close the mean intensity is to mid gray, 1 for a mean of 128 """
+    return 1 - np.abs(statistics.mean(gray) - 128) / 128
+
+
+def shannon_entropy(statistics):
+    """ Entropy in bits of the grayscale histogram """
+    return blocks.histogram_entropy(statistics.histogram())
+
+
+def bie(statistics, block_size=15):
+    """ Block based image enhancement measure combining contrast, brightness and block entropies """
+    # entropies of all whole blocks at once, from their histograms
+    block_entropies = statistics.block_entropies(block_size, ragged=False).ravel()
+    block_contrasts = statistics.block_std(block_size, ragged=False).ravel()
+
+    # Calculate mean entropy across blocks
+    mean_block_entropy = np.mean(block_entropies)
+    mean_block_contrast = np.mean(block_contrasts)
+
+    # Calculate AME of the entire image
+    image_entropy = ame(statistics, block_size, modified=True)
+
+    m = mean_deviation(statistics, gray=True)
+
+    p = m * statistics.std() / (mean_block_contrast + 1)
+
+    # Calculate the metric
+    return p * image_entropy / (1 + mean_block_entropy)
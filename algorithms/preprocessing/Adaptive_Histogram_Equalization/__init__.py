@@ -1,56 +1,133 @@
 import cv2
 import numpy as pb
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+from algorithms.common.equalization import clip_histogram, equalization_lut
+from guimg.jobs import checkpoint, current_job
 
-def hist_equalization(img):
-    """ Normal Histogram Equalization
+# form in which main expects its input image, see guimg.imaging.IMAGE_FORMATS
+INPUT_FORMAT = 'bgr'
 
-    Args:
-        img : image input with single channel
+def _tile_histograms(v, rx, ry, pool):
+    """ Histograms of all tiles as a (tiles_y, tiles_x, 256) array, rows of tiles are counted in parallel """
+    def tile_row(j):
+        # cv2.calcHist releases the GIL and beats a bincount with per tile offsets by ~3x
+        return [cv2.calcHist([v[j:j + ry, i:i + rx]], [0], None, [256], [0, 256]).ravel()
+                for i in range(0, v.shape[1], rx)]
+
+    return pb.array(list(pool.map(tile_row, range(0, v.shape[0], ry))), dtype=pb.int64)
+
+
+def _interpolation_runs(length, size, count):
+    """ Splits an axis into runs of pixels lying between the same two tile centers
 
     Returns:
-        : Equalized Image
+        : list of (slice, first tile, second tile, weights of the second tile) tuples
     """
-    array = pb.asarray(img)
-    bin_cont = pb.bincount(array.flatten(), minlength=256)
-    pixels = pb.sum(bin_cont)
-    bin_cont = bin_cont / pixels
-    cumulative_sumhist = pb.cumsum(bin_cont)
-    map = pb.floor(255 * cumulative_sumhist).astype(pb.uint8)
-    arr_list = list(array.flatten())
-    eq_arr = [map[p] for p in arr_list]
-    arr_back = pb.reshape(pb.asarray(eq_arr), array.shape)
-    return arr_back
-
-
-def ahe(img, rx=136, ry=185):
+    starts = pb.arange(count) * size
+    centers = (starts + pb.minimum(starts + size, length)) / 2
+    positions = pb.arange(length) + 0.5
+    # index of the first tile center right of each pixel, constant within a run
+    following = pb.searchsorted(centers, positions)
+    bounds = pb.flatnonzero(pb.diff(following)) + 1
+    runs = []
+    for begin, end in zip(pb.r_[0, bounds], pb.r_[bounds, length]):
+        second = min(following[begin], count - 1)
+        first = max(following[begin] - 1, 0)
+        span = centers[second] - centers[first]
+        if span > 0:
+            weights = ((positions[begin:end] - centers[first]) / span).astype(pb.float32)
+        else:
+            weights = pb.zeros(end - begin, dtype=pb.float32)
+        runs.append((slice(begin, end), first, second, weights))
+    return runs
+
+
+def ahe(img, rx=136, ry=185, clip_limit=None, interpolate=True, workers=None):
     """ Adaptive Histogram Equalization
 
+    The histograms of all tiles are computed up front, one row of tiles per thread. With interpolate each pixel is mapped
+    through the LUTs of the four tiles around it and the results are blended bilinearly (as in CLAHE),
+    which avoids seams at tile borders. Edge tiles may be smaller, so any image size works.
+
     Args:
         img : image input with single channel
-        rx (int, optional): to divide horizontal regions, Note: Should be divisible by image size in x . Defaults to 136.
-        ry (int, optional): to divide vertical regions, Note: Should be divisible by image size in y. Defaults to 185.
+        rx (int, optional): width of the tiles. Defaults to 136.
+        ry (int, optional): height of the tiles. Defaults to 185.
+        clip_limit (float, optional): limit the contrast by clipping the tile histograms at clip_limit times
+            the average bin count (CLAHE), None disables the clipping. Defaults to None.
+        interpolate (bool, optional): blend between neighbouring tiles, False equalizes every tile on its own.
+            Defaults to True.
+        workers (int, optional): threads to spread the tiles over. Defaults to the number of cores.
 
     Returns:
         : Equalized Image
     """
-    v = img
-    img_eq = pb.empty((v.shape[0], v.shape[1]), dtype=pb.uint8)
-    for i in range(0, v.shape[1], rx):
-        for j in range(0, v.shape[0], ry):
-            t = v[j:j + ry, i:i + rx]
-            c = hist_equalization(t)
-            img_eq[j:j + ry, i:i + rx] = c
-    return img_eq
-
-
-def main(image):
-    img = cv2.imread(image, 1)
+    v = pb.ascontiguousarray(img)
+    height, width = v.shape
+    tiles_y = -(-height // ry)
+    tiles_x = -(-width // rx)
+    # the bands run on pool threads, they check the job of the calling thread for cancellation
+    job = current_job()
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        hists = _tile_histograms(v, rx, ry, pool)
+        if clip_limit is not None:
+            hists = clip_histogram(hists, clip_limit)
+        # one 256 entry LUT per tile, flattened so a pixel's entry is at tile * 256 + intensity
+        luts = equalization_lut(hists).ravel()
+        checkpoint()
+
+        if not interpolate:
+            def equalize_tile_row(j):
+                band = v[j:j + ry]
+                tile_offsets = ((j // ry * tiles_x + pb.arange(width) // rx) * 256).astype(pb.int32)
+                return pb.take(luts, band + tile_offsets)
+
+            return pb.concatenate(list(pool.map(equalize_tile_row, range(0, height, ry))))
+
+        # float LUTs, so cv2.LUT directly gives the values to blend
+        luts = luts.reshape(tiles_y, tiles_x, 256).astype(pb.float32)
+        x_runs = _interpolation_runs(width, rx, tiles_x)
+        img_eq = pb.empty((height, width), dtype=pb.uint8)
+
+        def equalize_band(y_run):
+            if job is not None:
+                job.check()
+            rows, top, bottom, wy = y_run
+            wy = wy[:, None]
+            for columns, left, right, wx in x_runs:
+                region = v[rows, columns]
+                # every pixel of the region lies between the same four tile centers,
+                # blend their mappings in place: upper/lower rows along x, then the two rows along y
+                upper = cv2.LUT(region, luts[top, left])
+                upper_right = cv2.LUT(region, luts[top, right])
+                upper_right -= upper
+                upper_right *= wx
+                upper += upper_right
+                lower = cv2.LUT(region, luts[bottom, left])
+                lower_right = cv2.LUT(region, luts[bottom, right])
+                lower_right -= lower
+                lower_right *= wx
+                lower += lower_right
+                lower -= upper
+                lower *= wy
+                upper += lower
+                img_eq[rows, columns] = pb.rint(upper, out=upper)
+
+        y_runs = _interpolation_runs(height, ry, tiles_y)
+        for done, _ in enumerate(pool.map(equalize_band, y_runs), 1):
+            checkpoint(done, len(y_runs))
+        return img_eq
+
+
+def main(image, rx=136, ry=185, clip_limit=None, interpolate=True):
+    img = cv2.imread(image, 1) if isinstance(image, str) else image
     # Covert to HSV
     hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     h, s, v = cv2.split((hsv))
-    ahe_v = ahe(v)
+    ahe_v = ahe(v, rx, ry, clip_limit=clip_limit, interpolate=interpolate)
     merged_ahe = cv2.merge((h, s, ahe_v))
     ahe_img = cv2.cvtColor(merged_ahe, cv2.COLOR_HSV2BGR)
 
@@ -1,31 +1,41 @@
 import cv2
-import numpy as pb
 import os
 
+from algorithms.common.equalization import apply_lut, equalization_lut, hist_equalization, histogram
+from guimg.jobs import checkpoint
+from guimg.tiled import TiledImage
 
-def hist_equalization(img):
-    """ Normal Histogram Equalization
+# form in which main expects its input image, see guimg.imaging.IMAGE_FORMATS
+INPUT_FORMAT = 'bgr'
+# large images come as a guimg.tiled.TiledImage and are equalized band by band
+TILED_INPUT = True
 
-    Args:
-        img : image input with single channel
 
-    Returns:
-        : Equalized Image
+def equalize_tiled(image):
+    """ Equalizes a TiledImage into a new one in two passes over its bands, holding one band at a time
+
+    The first pass sums the histogram of the V channel, the second maps every band through the lookup table,
+    HSV conversions are per pixel, so the result is the same as equalizing the whole image.
     """
-    array = pb.asarray(img)
-    bin_cont = pb.bincount(array.flatten(), minlength=256)
-    pixels = pb.sum(bin_cont)
-    bin_cont = bin_cont / pixels
-    cumulative_sumhist = pb.cumsum(bin_cont)
-    map = pb.floor(255 * cumulative_sumhist).astype(pb.uint8)
-    arr_list = list(array.flatten())
-    eq_arr = [map[p] for p in arr_list]
-    arr_back = pb.reshape(pb.asarray(eq_arr), array.shape)
-    return arr_back
+    bands = list(image.bands())
+    v_hist = 0
+    for done, (top, bottom) in enumerate(bands):
+        checkpoint(done, 2 * len(bands))
+        v_hist = v_hist + histogram(cv2.cvtColor(image.read(top, bottom), cv2.COLOR_BGR2HSV)[..., 2])
+    lut = equalization_lut(v_hist)
+
+    equalized = TiledImage.empty(image.shape[:2] + (3,))
+    for done, (top, bottom) in enumerate(bands, len(bands)):
+        checkpoint(done, 2 * len(bands))
+        h, s, v = cv2.split(cv2.cvtColor(image.read(top, bottom), cv2.COLOR_BGR2HSV))
+        equalized.write(top, 0, cv2.cvtColor(cv2.merge((h, s, apply_lut(v, lut))), cv2.COLOR_HSV2BGR))
+    return equalized
 
 
 def main(image):
-    img = cv2.imread(image, 1)
+    if isinstance(image, TiledImage):
+        return equalize_tiled(image)
+    img = cv2.imread(image, 1) if isinstance(image, str) else image
     # Covert to HSV
     hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     h, s, v = cv2.split((hsv))
@@ -1,6 +1,47 @@
-from algorithms.preprocessing.Zero_DCE.lowlight_test import lowlight
+from algorithms.preprocessing.Zero_DCE.lowlight_test import TILED_MEMORY_MB, get_session, tile_size_for
+from guimg.tiled import TiledImage
 from PIL import Image
 
-def main(image_path):
-    data_lowlight = Image.open(image_path)
-    return lowlight(data_lowlight)
\ No newline at end of file
+# form in which main expects its input image, see guimg.imaging.IMAGE_FORMATS
+INPUT_FORMAT = 'pil'
+# large images come as a guimg.tiled.TiledImage and are enhanced tile by tile into a new one
+TILED_INPUT = True
+
+
+def warmup():
+    """ Loads the weights once per process, called by the batch executor before the first image """
+    get_session().warmup()
+
+
+def main(image, max_memory_mb=None, tile_size=None, batch_size=8, backend=None):
+    """ Enhances a low-light image with Zero-DCE
+
+    Args:
+        image : path, RGB PIL image or TiledImage
+        max_memory_mb (float, optional): cap on the memory of the network, larger images are enhanced
+            in overlapping tiles with the same result. Defaults to None, no cap (TILED_MEMORY_MB for a TiledImage).
+        tile_size (int, optional): cut the image into tiles of this size and run them through the network
+            batch_size at a time. Defaults to None, the whole image at once.
+        batch_size (int, optional): tiles per batch when tile_size is set. Defaults to 8.
+        backend (str, optional): 'eager', an exported artifact such as 'int8.nhwc' or 'auto' for the fastest,
+            see export.py. Defaults to None, the float32 model (DEFAULT_BACKEND).
+    """
+    session = get_session(backend)
+    if isinstance(image, TiledImage):
+        return session.enhance_tiled_image(image, tile_size or tile_size_for(max_memory_mb or TILED_MEMORY_MB))
+    data_lowlight = Image.open(image) if isinstance(image, str) else image
+    if tile_size is not None:
+        return session.enhance_batch([data_lowlight], tile_size=tile_size, batch_size=batch_size)[0]
+    return session.enhance(data_lowlight, max_memory_mb=max_memory_mb)
+
+
+def main_batch(images, max_memory_mb=None, tile_size=None, batch_size=8, backend=None):
+    """ main for a list of images, used by the batch executor
+
+    Images of the same size (or their tiles, with tile_size) are run through the network together.
+    """
+    session = get_session(backend)
+    data_lowlight = [Image.open(image) if isinstance(image, str) else image for image in images]
+    if max_memory_mb is not None and tile_size is None:
+        return [session.enhance(image, max_memory_mb=max_memory_mb) for image in data_lowlight]
+    return session.enhance_batch(data_lowlight, tile_size=tile_size, batch_size=batch_size)
@@ -6,12 +6,17 @@ import torch.utils.data as data
 
 import numpy as np
 from PIL import Image
+import argparse
 import glob
+import json
 import random
 import cv2
 
 random.seed(1143)
 
+# side of the square training images
+TRAIN_SIZE = 256
+
 
 def populate_train_list(lowlight_images_path):
 
@@ -26,34 +31,95 @@ def populate_train_list(lowlight_images_path):
 
 	return train_list
 
-	
 
-class lowlight_loader(data.Dataset):
+def packed_path_for(lowlight_images_path, size=TRAIN_SIZE):
+	""" Default location of the packed training set, next to the images """
+	return os.path.join(lowlight_images_path, "packed_%d.npy" % size)
 
-	def __init__(self, lowlight_images_path):
 
-		self.train_list = populate_train_list(lowlight_images_path) 
-		self.size = 256
+def _listing(train_list):
+	# name, size and modification time of every image, the packed set is rebuilt when any of them changes
+	return sorted([os.path.basename(path), os.path.getsize(path), int(os.path.getmtime(path))] for path in train_list)
 
-		self.data_list = self.train_list
-		print("Total training examples:", len(self.train_list))
 
+def pack_train_set(lowlight_images_path, packed_path=None, size=TRAIN_SIZE):
+	""" Decodes and resizes the training images once into a memory-mapped NxHxWx3 uint8 RGB .npy file
 
-		
+	The images are written one at a time, so packing needs no more memory than one image. A JSON file next to
+	the packed set lists the images it was made from, it is reused as long as they are unchanged.
+
+	Args:
+		lowlight_images_path (str): directory of the .jpg training images, with a trailing separator
+		packed_path (str, optional): where to write the packed set. Defaults to packed_path_for(lowlight_images_path).
+		size (int, optional): side the images are resized to. Defaults to TRAIN_SIZE.
+
+	Returns:
+		: the path of the packed set
+	"""
+	packed_path = packed_path or packed_path_for(lowlight_images_path, size)
+	listing_path = os.path.splitext(packed_path)[0] + ".json"
+	train_list = populate_train_list(lowlight_images_path)
+	listing = {"size": size, "images": _listing(train_list)}
+	if os.path.exists(packed_path) and os.path.exists(listing_path):
+		with open(listing_path) as f:
+			if json.load(f) == listing:
+				return packed_path
+
+	print("Packing", len(train_list), "training examples into", packed_path)
+	tmp_path = packed_path + ".tmp.npy"
+	packed = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(len(train_list), size, size, 3))
+	for index, path in enumerate(train_list):
+		with Image.open(path) as image:
+			packed[index] = np.asarray(image.convert('RGB').resize((size, size), Image.LANCZOS))
+	packed.flush()
+	del packed
+	os.replace(tmp_path, packed_path)
+	with open(listing_path, "w") as f:
+		json.dump(listing, f)
+	return packed_path
 
-	def __getitem__(self, index):
 
-		data_lowlight_path = self.data_list[index]
-		
-		data_lowlight = Image.open(data_lowlight_path)
-		
-		data_lowlight = data_lowlight.resize((self.size,self.size), Image.ANTIALIAS)
+def to_input_batch(batch):
+	""" NxHxWx3 uint8 batch from lowlight_loader -> Nx3xHxW float tensor in [0, 1]
+
+	Call it after moving the batch to the device, a uint8 batch is a quarter of the bytes to transfer.
+	Gives the same values as the float64 division the images were converted with before.
+	"""
+	return batch.permute(0, 3, 1, 2).float().div_(255)
+
+
+
+class lowlight_loader(data.Dataset):
+	""" The training set packed by pack_train_set, items are HxWx3 uint8 views into the memory-mapped file
 
-		data_lowlight = (np.asarray(data_lowlight)/255.0) 
-		data_lowlight = torch.from_numpy(data_lowlight).float()
+	Nothing is decoded or converted per item, convert the collated batch with to_input_batch.
+	The set is packed on first use and whenever the images change.
+	"""
 
-		return data_lowlight.permute(2,0,1)
+	def __init__(self, lowlight_images_path, packed_path=None):
+
+		self.size = TRAIN_SIZE
+		self.packed_path = pack_train_set(lowlight_images_path, packed_path, self.size)
+		# copy-on-write, so torch gets writable arrays without copying the file
+		self.data_list = np.load(self.packed_path, mmap_mode='c')
+		print("Total training examples:", len(self.data_list))
+
+
+
+
+	def __getitem__(self, index):
+
+		return torch.from_numpy(self.data_list[index])
 
 	def __len__(self):
 		return len(self.data_list)
 
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Packs the training images once, lowlight_train.py reuses the packed set")
+	parser.add_argument('--lowlight_images_path', type=str, default="data/train_data/")
+	parser.add_argument('--packed_path', type=str, default=None)
+	config = parser.parse_args()
+
+	print(pack_train_set(config.lowlight_images_path, config.packed_path))
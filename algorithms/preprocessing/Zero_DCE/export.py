@@ -0,0 +1,160 @@
+import argparse
+import glob
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+import algorithms.preprocessing.Zero_DCE.model as model
+from algorithms.preprocessing.Zero_DCE.lowlight_test import EXPORT_DIRECTORY, WEIGHTS_PATH, flush_denormals, \
+	to_input_tensor
+
+
+# accuracy gate against the eager model on the reference set: (max abs error, min PSNR in dB)
+TOLERANCES = {
+	'fp32': (1e-4, 80.0),
+	'int8': (0.1, 30.0),
+}
+
+
+class ExportableEnhancer(nn.Module):
+	""" Inference graph of enhance_net_nopool for export
+
+	Same convolutions as the model, the 8 curve iterations x + r * (x^2 - x) are unrolled and
+	folded into one in-place multiply-add per iteration instead of four separate full size ops.
+	"""
+
+	def __init__(self, DCE_net):
+		super(ExportableEnhancer, self).__init__()
+		self.net = DCE_net
+
+	def forward(self, x):
+		net = self.net
+		x1 = net.relu(net.e_conv1(x))
+		x2 = net.relu(net.e_conv2(x1))
+		x3 = net.relu(net.e_conv3(x2))
+		x4 = net.relu(net.e_conv4(x3))
+		x5 = net.relu(net.e_conv5(torch.cat([x3,x4],1)))
+		x6 = net.relu(net.e_conv6(torch.cat([x2,x5],1)))
+		x_r = torch.tanh(net.e_conv7(torch.cat([x1,x6],1)))
+		x = x.clone()
+		for i in range(8):
+			x = torch.addcmul(x, x_r[:, 3 * i:3 * i + 3], x * (x - 1))
+		return x
+
+
+def load_eager(weights_path=WEIGHTS_PATH):
+	DCE_net = model.enhance_net_nopool()
+	DCE_net.load_state_dict(flush_denormals(torch.load(weights_path, map_location='cpu')))
+	return DCE_net.eval()
+
+
+def reference_set(directory=None, count=6, size=(192, 256)):
+	""" Images the exported graphs are checked against, synthetic low-light images if no directory is given """
+	if directory is not None:
+		paths = sorted(p for p in glob.glob(os.path.join(directory, '*')) if p.lower().endswith(('.png', '.jpg', '.jpeg')))
+		return [to_input_tensor(Image.open(p).convert('RGB')) for p in paths]
+	rng = np.random.default_rng(1143)
+	images = []
+	for i in range(count):
+		# smooth dark gradients with noise, the gain varies per image
+		y, x = np.mgrid[0:size[0], 0:size[1]] / max(size)
+		base = np.stack([np.sin(3 * x + i) * np.cos(2 * y - i), np.cos(4 * y + i), np.sin(5 * (x + y))], -1)
+		image = (base + 1) / 2 * (0.1 + 0.05 * i) + rng.normal(0, 0.01, base.shape)
+		images.append(torch.from_numpy(np.clip(image, 0, 1)).float().permute(2, 0, 1).unsqueeze(0))
+	return images
+
+
+def quantize_int8(enhancer, calibration):
+	""" Post training static int8 quantization of the convolutions, calibrated on the given images """
+	from torch.ao.quantization import get_default_qconfig_mapping
+	from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+	prepared = prepare_fx(enhancer, get_default_qconfig_mapping('x86'), example_inputs=(calibration[0],))
+	with torch.inference_mode():
+		for image in calibration:
+			prepared(image)
+	return convert_fx(prepared)
+
+
+def accuracy(graph, eager, images, channels_last=False):
+	""" Worst max abs error and PSNR of graph against the eager model over images """
+	max_error, min_psnr = 0.0, float('inf')
+	with torch.inference_mode():
+		for image in images:
+			expected = eager.enhance(image)
+			if channels_last:
+				image = image.contiguous(memory_format=torch.channels_last)
+			error = (graph(image) - expected).abs()
+			mse = float((error ** 2).mean())
+			max_error = max(max_error, float(error.max()))
+			min_psnr = min(min_psnr, 10 * np.log10(1 / mse) if mse > 0 else float('inf'))
+	return max_error, min_psnr
+
+
+def build(precision='fp32', channels_last=False, reference=None, weights_path=WEIGHTS_PATH, directory=EXPORT_DIRECTORY):
+	""" Exports a frozen TorchScript graph of the model and checks it against the eager model
+
+	Args:
+		precision (str, optional): 'fp32' or 'int8' (static quantization of the convolutions). Defaults to 'fp32'.
+		channels_last (bool, optional): trace the graph with NHWC memory layout. Defaults to False.
+		reference (str, optional): directory with reference images for calibration and the accuracy gate.
+			Defaults to None, a synthetic low-light set.
+		weights_path (str, optional): snapshot to export. Defaults to WEIGHTS_PATH.
+		directory (str, optional): where the artifact is written. Defaults to EXPORT_DIRECTORY.
+
+	Returns:
+		: path of the artifact, or None if it failed the accuracy gate
+	"""
+	eager = load_eager(weights_path)
+	images = reference_set(reference)
+	enhancer = ExportableEnhancer(load_eager(weights_path)).eval()
+	example = images[0]
+	# torch.ao.quantization and TorchScript warn about their deprecation on every call
+	with torch.no_grad(), warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		if precision == 'int8':
+			enhancer = quantize_int8(enhancer, images)
+		if channels_last:
+			enhancer = enhancer.to(memory_format=torch.channels_last)
+			example = example.contiguous(memory_format=torch.channels_last)
+		graph = torch.jit.freeze(torch.jit.trace(enhancer, example))
+
+	max_error, min_psnr = accuracy(graph, eager, images, channels_last)
+	tolerance_error, tolerance_psnr = TOLERANCES[precision]
+	passed = max_error <= tolerance_error and min_psnr >= tolerance_psnr
+	name = f"{os.path.splitext(os.path.basename(weights_path))[0]}.{precision}{'.nhwc' if channels_last else ''}"
+	print(f"{name}: max abs error {max_error:.2e}, min PSNR {min_psnr:.1f} dB -> {'passed' if passed else 'FAILED'}")
+	if not passed:
+		return None
+
+	os.makedirs(directory, exist_ok=True)
+	path = os.path.join(directory, f"{name}.pt")
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		torch.jit.save(graph, path)
+	with open(path + '.json', 'w') as f:
+		json.dump({'precision': precision, 'channels_last': channels_last, 'max_abs_error': max_error,
+				   'min_psnr': min_psnr, 'weights': os.path.basename(weights_path), 'created': time.time()}, f)
+	return path
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Export Zero-DCE to TorchScript artifacts picked up by lowlight_test")
+	parser.add_argument('--precision', choices=['fp32', 'int8', 'all'], default='all')
+	parser.add_argument('--channels_last', choices=['yes', 'no', 'both'], default='both')
+	parser.add_argument('--reference', type=str, default=None, help="directory with reference images")
+	parser.add_argument('--weights', type=str, default=WEIGHTS_PATH)
+
+	config = parser.parse_args()
+	precisions = ['fp32', 'int8'] if config.precision == 'all' else [config.precision]
+	layouts = {'yes': [True], 'no': [False], 'both': [False, True]}[config.channels_last]
+	for precision in precisions:
+		for channels_last in layouts:
+			build(precision, channels_last, config.reference, config.weights)
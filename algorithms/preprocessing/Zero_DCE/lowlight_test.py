@@ -1,21 +1,302 @@
 import algorithms.preprocessing.Zero_DCE.model as model
 import torch
 import torch.optim
+import glob
+import json
 import os
+import threading
+import time
 import numpy as np
 
+from guimg.imaging import to_bgr
+from guimg.jobs import checkpoint
+from guimg.tiled import TiledImage
 
- 
-def lowlight(data_lowlight):
-	os.environ['CUDA_VISIBLE_DEVICES']='0'
+
+WEIGHTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots', 'Epoch99.pth')
+# TorchScript artifacts built by export.py
+EXPORT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots', 'export')
+# receptive field radius of the seven chained 3x3 convolutions, a tile needs this many extra pixels on each side
+HALO = 7
+# measured peak memory of enhance_net_nopool.enhance per input pixel on CPU, float32
+BYTES_PER_PIXEL = 1280
+# memory budget of the network for a TiledImage when none is given
+TILED_MEMORY_MB = 512
+# backend of the sessions nobody asked a backend of, the float32 model, so results never depend on what is exported
+DEFAULT_BACKEND = 'eager'
+
+
+def to_input_tensor(data_lowlight):
+	""" PIL image or HxWx3 uint8 RGB array -> 1x3xHxW float tensor in [0, 1], float tensors are passed through """
+	if isinstance(data_lowlight, torch.Tensor):
+		return data_lowlight if data_lowlight.dim() == 4 else data_lowlight.unsqueeze(0)
 	data_lowlight = (np.asarray(data_lowlight)/255.0)
 	data_lowlight = torch.from_numpy(data_lowlight).float()
 	data_lowlight = data_lowlight.permute(2,0,1)
-	data_lowlight = data_lowlight.unsqueeze(0)
+	return data_lowlight.unsqueeze(0)
+
+
+def flush_denormals(state_dict):
+	""" Zeroes the denormal weights of a state dict in place
+
+	The trained snapshot contains weights below the smallest normal float32, CPUs handle those
+	in microcode which makes every convolution ~50x slower. Their contribution to the output is far
+	below float32 precision, the enhanced images stay the same.
+	"""
+	for tensor in state_dict.values():
+		if tensor.is_floating_point():
+			tensor[tensor.abs() < torch.finfo(tensor.dtype).tiny] = 0
+	return state_dict
+
+
+def tile_size_for(max_memory_mb):
+	""" Largest tile side whose inference, halo included, fits in max_memory_mb """
+	side = int((max_memory_mb * 2 ** 20 / BYTES_PER_PIXEL) ** 0.5) - 2 * HALO
+	return max(side, 2 * HALO)
+
+
+def exported_backends(weights_path=WEIGHTS_PATH, directory=EXPORT_DIRECTORY):
+	""" { name: (graph, channels_last) } of the artifacts export.py built from weights_path
+
+	Artifacts older than the weights are skipped, every artifact passed export.py's accuracy gate when it was built.
+	"""
+	backends = {}
+	for metadata_path in sorted(glob.glob(os.path.join(directory, '*.pt.json'))):
+		graph_path = metadata_path[:-len('.json')]
+		with open(metadata_path) as f:
+			metadata = json.load(f)
+		if metadata.get('weights') != os.path.basename(weights_path) or not os.path.exists(graph_path):
+			continue
+		if os.path.getmtime(graph_path) < os.path.getmtime(weights_path):
+			continue
+		name = os.path.basename(graph_path)[:-len('.pt')].split('.', 1)[1]
+		backends[name] = (torch.jit.load(graph_path, map_location='cpu').eval(), metadata['channels_last'])
+	return backends
+
+
+def fastest_backend(backends, size=128, repeat=2):
+	""" Name of the backend with the shortest best-of-repeat time on a size x size image """
+	if len(backends) == 1:
+		return next(iter(backends))
+	sample = torch.full((1, 3, size, size), 0.3)
+	timings = {}
+	with torch.inference_mode():
+		for name, (graph, channels_last) in backends.items():
+			x = sample.contiguous(memory_format=torch.channels_last) if channels_last else sample
+			graph(x)
+			best = float('inf')
+			for _ in range(repeat):
+				began = time.perf_counter()
+				graph(x)
+				best = min(best, time.perf_counter() - began)
+			timings[name] = best
+	return min(timings, key=timings.get)
+
+
+class LowlightSession:
+	""" Long lived Zero-DCE inference session
+
+	The network is built and its weights are loaded once, inference runs in eval mode
+	without autograd, so no activations are kept around for a backward pass.
+
+	Args:
+		weights_path (str, optional): snapshot to load. Defaults to WEIGHTS_PATH.
+		device (str, optional): torch device. Defaults to 'cpu'.
+		backend (str, optional): 'eager', the name of an exported artifact (e.g. 'int8.nhwc', see export.py)
+			or 'auto' to time all available ones on load and use the fastest. 'auto' and the int8 artifacts
+			trade exactness for speed, only use them when asked for. Defaults to DEFAULT_BACKEND.
+
+	Raises:
+		ValueError: if there is no artifact of the given backend
+	"""
+
+	def __init__(self, weights_path=WEIGHTS_PATH, device='cpu', backend=DEFAULT_BACKEND):
+		os.environ['CUDA_VISIBLE_DEVICES']='0'
+		self.device = torch.device(device)
+		self.DCE_net = model.enhance_net_nopool()
+		self.DCE_net.load_state_dict(flush_denormals(torch.load(weights_path, map_location=self.device)))
+		self.DCE_net.to(self.device).eval()
+		# { batch_size: (images, seconds) } of the batches run so far, see throughput
+		self.stats = {}
+		self._stats_lock = threading.Lock()
+
+		backends = {'eager': (self.DCE_net.enhance, False)}
+		# the artifacts are only loaded when one of them may be used
+		if self.device.type == 'cpu' and backend != 'eager':
+			backends.update(exported_backends(weights_path))
+		if backend not in backends and backend != 'auto':
+			raise ValueError(f"No Zero-DCE backend {backend!r}, available: {', '.join(backends)} and 'auto' "
+							 f"(run export.py to build the exported ones)")
+		if backend == 'auto':
+			backend = fastest_backend(backends)
+		self.backend = backend
+		self._graph, self._channels_last = backends[backend]
+
+	def _forward(self, x):
+		if self._channels_last:
+			x = x.contiguous(memory_format=torch.channels_last)
+		return self._graph(x)
+
+	def warmup(self, size=64):
+		""" Runs a small dummy image through the network, so the first real image doesn't pay for lazy initialization """
+		self.enhance(torch.full((1, 3, size, size), 0.5))
+
+	def enhance(self, data_lowlight, max_memory_mb=None):
+		""" Enhances a PIL image, HxWx3 uint8 RGB array or float tensor and returns a 1x3xHxW tensor
+
+		Args:
+			data_lowlight : the image
+			max_memory_mb (float, optional): memory budget of the network, images which would need more
+				are enhanced tile by tile. Defaults to None, no limit.
+		"""
+		data_lowlight = to_input_tensor(data_lowlight)
+		if max_memory_mb is not None:
+			tile_size = tile_size_for(max_memory_mb)
+			if max(data_lowlight.shape[2:]) > tile_size:
+				return self.enhance_tiled(data_lowlight, tile_size)
+		with torch.inference_mode():
+			return self._forward(data_lowlight.to(self.device))
+
+	def enhance_tiled(self, data_lowlight, tile_size):
+		""" Enhances the image in tile_size x tile_size tiles and stitches them together
+
+		Every tile is run with a HALO pixel border of its neighbours, which covers the receptive field
+		of the network, so the result matches enhancing the whole frame at once.
+		"""
+		data_lowlight = to_input_tensor(data_lowlight)
+		_, _, height, width = data_lowlight.shape
+		tiles = -(-height // tile_size) * -(-width // tile_size)
+		done = 0
+		with torch.inference_mode():
+			enhanced_image = torch.empty_like(data_lowlight, device=self.device)
+			for top in range(0, height, tile_size):
+				bottom = min(top + tile_size, height)
+				outer_top, outer_bottom = max(top - HALO, 0), min(bottom + HALO, height)
+				for left in range(0, width, tile_size):
+					# lets a cancelled job stop between tiles
+					checkpoint(done, tiles)
+					done += 1
+					right = min(left + tile_size, width)
+					outer_left, outer_right = max(left - HALO, 0), min(right + HALO, width)
+					tile = data_lowlight[:, :, outer_top:outer_bottom, outer_left:outer_right].to(self.device)
+					enhanced_tile = self._forward(tile)
+					enhanced_image[:, :, top:bottom, left:right] = enhanced_tile[
+						:, :, top - outer_top:bottom - outer_top, left - outer_left:right - outer_left]
+		return enhanced_image
+
+	def enhance_tiled_image(self, image, tile_size):
+		""" Enhances a guimg.tiled.TiledImage tile by tile into a new TiledImage
+
+		Only one tile with its HALO border is read from the memory-mapped input at a time and every enhanced tile is
+		quantized to uint8 BGR and written out right away, so the memory stays bounded for images of any size.
+		The pixels are those of enhance_tiled converted to BGR.
+		"""
+		height, width = image.shape[:2]
+		tiles = -(-height // tile_size) * -(-width // tile_size)
+		done = 0
+		enhanced_image = TiledImage.empty((height, width, 3))
+		with torch.inference_mode():
+			for top in range(0, height, tile_size):
+				bottom = min(top + tile_size, height)
+				outer_top, outer_bottom = max(top - HALO, 0), min(bottom + HALO, height)
+				for left in range(0, width, tile_size):
+					checkpoint(done, tiles)
+					done += 1
+					right = min(left + tile_size, width)
+					outer_left, outer_right = max(left - HALO, 0), min(right + HALO, width)
+					tile = image.read(outer_top, outer_bottom, outer_left, outer_right)[..., ::-1]
+					enhanced_tile = self._forward(to_input_tensor(tile).to(self.device))
+					enhanced_image.write(top, left, to_bgr(enhanced_tile[
+						:, :, top - outer_top:bottom - outer_top, left - outer_left:right - outer_left]))
+		return enhanced_image
+
+	def enhance_batch(self, images, tile_size=None, batch_size=8):
+		""" Enhances a list of images of any sizes, running them through the network in batches
+
+		Images are bucketed by size: with tile_size every image is cut into windows of
+		tile_size + 2 * HALO pixels (edge windows are shifted inwards, so they keep the full size),
+		without it every image is a window of its own. Windows of the same size are stacked into
+		NCHW batches of up to batch_size and the enhanced windows are stitched back into their images.
+
+		Returns:
+			: list with one 1x3xHxW tensor per image
+		"""
+		tensors = [to_input_tensor(image) for image in images]
+		buckets = {}
+		for index, tensor in enumerate(tensors):
+			_, _, height, width = tensor.shape
+			for rows in _windows(height, tile_size):
+				for columns in _windows(width, tile_size):
+					buckets.setdefault((rows[1] - rows[0], columns[1] - columns[0]), []).append((index, rows, columns))
+
+		total = sum(len(windows) for windows in buckets.values())
+		done = 0
+		with torch.inference_mode():
+			results = [torch.empty_like(tensor, device=self.device) for tensor in tensors]
+			for windows in buckets.values():
+				for start in range(0, len(windows), batch_size):
+					# lets a cancelled job stop between batches
+					checkpoint(done, total)
+					chunk = windows[start:start + batch_size]
+					done += len(chunk)
+					batch = torch.cat([tensors[index][:, :, rows[0]:rows[1], columns[0]:columns[1]]
+									   for index, rows, columns in chunk]).to(self.device)
+					began = time.perf_counter()
+					enhanced = self._forward(batch)
+					self._record(len(chunk), time.perf_counter() - began)
+					for (index, rows, columns), window in zip(chunk, enhanced):
+						top, bottom = rows[2] - rows[0], rows[3] - rows[0]
+						left, right = columns[2] - columns[0], columns[3] - columns[0]
+						results[index][0, :, rows[2]:rows[3], columns[2]:columns[3]] = window[:, top:bottom, left:right]
+		return results
+
+	def _record(self, batch_size, seconds):
+		with self._stats_lock:
+			images, total = self.stats.get(batch_size, (0, 0.0))
+			self.stats[batch_size] = (images + batch_size, total + seconds)
+
+	def throughput(self):
+		""" Images (or windows) per second of the network for every batch size run so far """
+		with self._stats_lock:
+			return {batch_size: images / seconds for batch_size, (images, seconds) in sorted(self.stats.items())}
+
+
+def _windows(length, tile_size):
+	""" Splits an axis into windows of the same size for enhance_batch
+
+	Returns:
+		: list of (window start, window end, core start, core end), the cores cover the axis exactly once
+		and every core has HALO pixels of context inside its window unless it touches the image border
+	"""
+	size = length if tile_size is None else tile_size + 2 * HALO
+	if length <= size:
+		return [(0, length, 0, length)]
+	windows = []
+	for start in range(0, length, tile_size):
+		end = min(start + tile_size, length)
+		window_start, window_end = max(start - HALO, 0), min(end + HALO, length)
+		# grow the windows at the borders to the full size, more context doesn't change the core
+		if window_start == 0:
+			window_end = size
+		elif window_end == length:
+			window_start = length - size
+		windows.append((window_start, window_end, start, end))
+	return windows
+
+
+# { backend: LowlightSession } of the process
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def get_session(backend=None):
+	""" The process wide session of backend (DEFAULT_BACKEND if None), created on first use """
+	backend = backend or DEFAULT_BACKEND
+	with _session_lock:
+		if backend not in _sessions:
+			_sessions[backend] = LowlightSession(backend=backend)
+		return _sessions[backend]
 
-	DCE_net = model.enhance_net_nopool()
-	module_path = os.path.join(os.getcwd(), 'algorithms', 'preprocessing', 'Zero_DCE')
-	DCE_net.load_state_dict(torch.load(f'{module_path}/snapshots/Epoch99.pth', map_location=torch.device('cpu')))
-	_,enhanced_image,_ = DCE_net(data_lowlight)
 
-	return enhanced_image
+def lowlight(data_lowlight, max_memory_mb=None):
+	return get_session().enhance(data_lowlight, max_memory_mb=max_memory_mb)
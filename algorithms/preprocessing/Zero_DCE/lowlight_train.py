@@ -26,26 +26,45 @@ def weights_init(m):
 
 
 
+def autocast_dtype(device, bf16):
+	""" torch.bfloat16 if bf16 autocast was asked for and the device supports it, else None """
+	if not bf16:
+		return None
+	if device.type == 'cuda' and not torch.cuda.is_bf16_supported():
+		print("bf16 isn't supported on", device, "- training in float32")
+		return None
+	return torch.bfloat16
+
+
+
 def train(config):
 
 	os.environ['CUDA_VISIBLE_DEVICES']='0'
 
-	DCE_net = model.enhance_net_nopool().cuda()
+	device = torch.device(config.device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+	if config.threads:
+		# intra-op threads of the CPU kernels, e.g. the cores left free by the data loader workers
+		torch.set_num_threads(config.threads)
+	memory_format = torch.channels_last if config.channels_last else torch.contiguous_format
+	amp_dtype = autocast_dtype(device, config.bf16)
+
+	DCE_net = model.enhance_net_nopool().to(device, memory_format=memory_format)
 
 	DCE_net.apply(weights_init)
 	if config.load_pretrain == True:
-	    DCE_net.load_state_dict(torch.load(config.pretrain_dir))
-	train_dataset = dataloader.lowlight_loader(config.lowlight_images_path)		
+	    DCE_net.load_state_dict(torch.load(config.pretrain_dir, map_location=device))
+	# packed once into a memory-mapped uint8 file, items are slices of it, see dataloader.pack_train_set
+	train_dataset = dataloader.lowlight_loader(config.lowlight_images_path, config.packed_path)
 	
-	train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=config.train_batch_size, shuffle=True, num_workers=config.num_workers, pin_memory=True)
+	train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=config.train_batch_size, shuffle=True, num_workers=config.num_workers, pin_memory=device.type == 'cuda')
 
 
 
-	L_color = Myloss.L_color()
-	L_spa = Myloss.L_spa()
+	L_color = Myloss.L_color().to(device)
+	L_spa = Myloss.L_spa().to(device)
 
-	L_exp = Myloss.L_exp(16,0.6)
-	L_TV = Myloss.L_TV()
+	L_exp = Myloss.L_exp(16,0.6).to(device)
+	L_TV = Myloss.L_TV().to(device)
 
 
 	optimizer = torch.optim.Adam(DCE_net.parameters(), lr=config.lr, weight_decay=config.weight_decay)
@@ -53,30 +72,36 @@ def train(config):
 	DCE_net.train()
 
 	for epoch in range(config.num_epochs):
+		epoch_start = time.perf_counter()
+		samples = 0
 		for iteration, img_lowlight in enumerate(train_loader):
 
-			img_lowlight = img_lowlight.cuda()
+			img_lowlight = dataloader.to_input_batch(img_lowlight.to(device, non_blocking=True))
+			img_lowlight = img_lowlight.contiguous(memory_format=memory_format)
 
-			enhanced_image_1,enhanced_image,A  = DCE_net(img_lowlight)
+			# bf16 forward and losses where supported, the weights and their gradients stay float32
+			with torch.autocast(device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+				enhanced_image_1,enhanced_image,A  = DCE_net(img_lowlight)
 
-			Loss_TV = 200*L_TV(A)
-			
-			loss_spa = torch.mean(L_spa(enhanced_image, img_lowlight))
+				Loss_TV = 200*L_TV(A)
+				
+				loss_spa = torch.mean(L_spa(enhanced_image, img_lowlight))
 
-			loss_col = 5*torch.mean(L_color(enhanced_image))
+				loss_col = 5*torch.mean(L_color(enhanced_image))
 
-			loss_exp = 10*torch.mean(L_exp(enhanced_image))
-			
-			
-			# best_loss
-			loss =  Loss_TV + loss_spa + loss_col + loss_exp
-			#
+				loss_exp = 10*torch.mean(L_exp(enhanced_image))
+				
+				
+				# best_loss
+				loss =  Loss_TV + loss_spa + loss_col + loss_exp
+				#
 
 			
 			optimizer.zero_grad()
 			loss.backward()
-			torch.nn.utils.clip_grad_norm(DCE_net.parameters(),config.grad_clip_norm)
+			torch.nn.utils.clip_grad_norm_(DCE_net.parameters(),config.grad_clip_norm)
 			optimizer.step()
+			samples += img_lowlight.shape[0]
 
 			if ((iteration+1) % config.display_iter) == 0:
 				print("Loss at iteration", iteration+1, ":", loss.item())
@@ -84,6 +109,11 @@ def train(config):
 				
 				torch.save(DCE_net.state_dict(), config.snapshots_folder + "Epoch" + str(epoch) + '.pth') 		
 
+		if device.type == 'cuda':
+			torch.cuda.synchronize(device)
+		seconds = time.perf_counter() - epoch_start
+		print("Epoch", epoch, ":", samples, "samples in %.1f s," % seconds, "%.1f samples/s" % (samples / seconds))
+
 
 
 
@@ -93,6 +123,7 @@ if __name__ == "__main__":
 
 	# Input Parameters
 	parser.add_argument('--lowlight_images_path', type=str, default="data/train_data/")
+	parser.add_argument('--packed_path', type=str, default=None)
 	parser.add_argument('--lr', type=float, default=0.0001)
 	parser.add_argument('--weight_decay', type=float, default=0.0001)
 	parser.add_argument('--grad_clip_norm', type=float, default=0.1)
@@ -105,6 +136,11 @@ if __name__ == "__main__":
 	parser.add_argument('--snapshots_folder', type=str, default="snapshots/")
 	parser.add_argument('--load_pretrain', type=bool, default= False)
 	parser.add_argument('--pretrain_dir', type=str, default= "snapshots/Epoch99.pth")
+	# Device Parameters
+	parser.add_argument('--device', type=str, default=None, help="cpu, cuda, cuda:1, ... Defaults to cuda if available")
+	parser.add_argument('--threads', type=int, default=None, help="intra-op threads of the CPU kernels")
+	parser.add_argument('--channels_last', action='store_true', help="NHWC layout, faster convolutions with oneDNN and tensor cores")
+	parser.add_argument('--bf16', action='store_true', help="bfloat16 autocast where the device supports it")
 
 	config = parser.parse_args()
 
@@ -55,5 +55,25 @@ class enhance_net_nopool(nn.Module):
 		r = torch.cat([r1,r2,r3,r4,r5,r6,r7,r8],1)
 		return enhance_image_1,enhance_image,r
 
+	def enhance(self, x):
+		""" Inference only forward pass, same result as forward()[1]
+
+		Returns only the enhanced image and drops every feature map as soon as the last layer using it is done,
+		so far fewer full resolution maps are alive at once.
+		"""
+		x1 = self.relu(self.e_conv1(x))
+		x2 = self.relu(self.e_conv2(x1))
+		x3 = self.relu(self.e_conv3(x2))
+		x4 = self.relu(self.e_conv4(x3))
+		x5 = self.relu(self.e_conv5(torch.cat([x3,x4],1)))
+		del x3, x4
+		x6 = self.relu(self.e_conv6(torch.cat([x2,x5],1)))
+		del x2, x5
+		x_r = F.tanh(self.e_conv7(torch.cat([x1,x6],1)))
+		del x1, x6
+		for r in torch.split(x_r, 3, dim=1):
+			x = x + r*(torch.pow(x,2)-x)
+		return x
+
 
 
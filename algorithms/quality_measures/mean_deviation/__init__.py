@@ -1,10 +1,19 @@
-import numpy as np
 import cv2
 
+from algorithms.common import quality
+
+# form in which main expects its input image, see guimg.imaging.IMAGE_FORMATS
+INPUT_FORMAT = 'bgr'
+# large images come as a guimg.tiled.TiledImage, their statistics are computed band by band
+TILED_INPUT = True
+
 
 def mean_deviation(image):
-    return 1 - np.abs(np.mean(image) - 128) / 128
+    return quality.mean_deviation(quality.ImageStatistics.of(image))
+
+def measure(image, shared):
+    return quality.mean_deviation(quality.ImageStatistics.shared(image, shared))
 
-def main(image_path):
-    image = cv2.imread(image_path)
-    return mean_deviation(image)
+def main(image):
+    image = cv2.imread(image) if isinstance(image, str) else image
+    return measure(image, {})
@@ -1,26 +1,22 @@
-import numpy as np
 import cv2
 
+from algorithms.common import quality
 
-def shannon_entropy(image):
-    # Convert image to grayscale
-    if len(image.shape) == 3:
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray_image = image
+# form in which main expects its input image, see guimg.imaging.IMAGE_FORMATS
+INPUT_FORMAT = 'bgr'
+# large images come as a guimg.tiled.TiledImage, their statistics are computed band by band
+TILED_INPUT = True
 
-    # Calculate histogram
-    hist = cv2.calcHist([gray_image], [0], None, [256], [0, 256])
 
-    # Compute probability of each intensity level
-    hist = hist.ravel() / hist.sum()
+def shannon_entropy(image):
+    return quality.shannon_entropy(quality.ImageStatistics.of(image))
 
-    # Compute Shannon entropy
-    entropy = -np.sum(hist * np.log2(hist + 1e-10))  # Adding a small value to avoid log(0)
 
-    return entropy
+def measure(image, shared):
+    # the grayscale image is shared with the other quality measures
+    return quality.shannon_entropy(quality.ImageStatistics.shared(image, shared))
 
 
-def main(image_path):
-    image = cv2.imread(image_path)
-    return shannon_entropy(image)
+def main(image):
+    image = cv2.imread(image) if isinstance(image, str) else image
+    return measure(image, {})
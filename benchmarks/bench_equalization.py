@@ -0,0 +1,48 @@
+""" Compares the shared LUT based hist_equalization with the former per pixel implementation
+
+Run from the repository root:
+    python -m benchmarks.bench_equalization
+"""
+import time
+
+import numpy as np
+
+from algorithms.common.equalization import hist_equalization
+
+
+def hist_equalization_per_pixel(img):
+    """ The implementation hist_equalization replaced, kept as the reference """
+    array = np.asarray(img)
+    bin_cont = np.bincount(array.flatten(), minlength=256)
+    pixels = np.sum(bin_cont)
+    bin_cont = bin_cont / pixels
+    cumulative_sumhist = np.cumsum(bin_cont)
+    map = np.floor(255 * cumulative_sumhist).astype(np.uint8)
+    arr_list = list(array.flatten())
+    eq_arr = [map[p] for p in arr_list]
+    return np.reshape(np.asarray(eq_arr), array.shape)
+
+
+def best_of(func, image, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(image)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    rng = np.random.default_rng(0)
+    for height, width in [(480, 640), (1080, 1920), (3000, 4000)]:
+        # low-light like distribution, most of the pixels are dark
+        channel = (rng.random((height, width)) ** 3 * 255).astype(np.uint8)
+        reference_time, reference = best_of(hist_equalization_per_pixel, channel, 1)
+        lut_time, result = best_of(hist_equalization, channel, 5)
+        assert np.array_equal(result, reference) and result.dtype == reference.dtype
+        print(f"{width}x{height}: per pixel {reference_time * 1000:9.1f} ms, "
+              f"LUT {lut_time * 1000:7.2f} ms, speedup {reference_time / lut_time:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+""" Images per second of Zero_DCE for a range of batch sizes, to tune --batch-size / batch_size
+
+Run from the repository root:
+    python -m benchmarks.bench_zero_dce_batch [tile_size] [images]
+"""
+import sys
+
+import torch
+
+from algorithms.preprocessing.Zero_DCE.lowlight_test import HALO, LowlightSession
+
+
+def main(tile_size=256, images=32, batch_sizes=(1, 2, 4, 8, 16)):
+    session = LowlightSession()
+    session.warmup()
+    # mixed sizes, enhance_batch tiles them into windows of the same size
+    sizes = [(tile_size, tile_size), (tile_size * 2, tile_size), (tile_size + 37, tile_size * 2 - 11)]
+    inputs = [torch.rand(1, 3, *sizes[i % len(sizes)]) * 0.3 for i in range(images)]
+    for batch_size in batch_sizes:
+        session.enhance_batch(inputs, tile_size=tile_size, batch_size=batch_size)
+    for batch_size, per_second in session.throughput().items():
+        print(f"batch size {batch_size:3d}: {per_second:7.2f} windows/s "
+              f"({tile_size + 2 * HALO}x{tile_size + 2 * HALO} px each)")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,213 @@
+""" Benchmark suite of all algorithm packages, with size sweeps and regression tracking
+
+Times the main function of every package and the kernels behind them on synthetic images
+from VGA to 50 MP (gray, color and low-light), records seconds, throughput and peak memory to a JSON lines
+history and flags cases that got slower than the stored baseline. Runs offline on CPU.
+
+Run from the repository root:
+    python -m benchmarks.suite                          # VGA to 12 MP, compares against the baseline if there is one
+    python -m benchmarks.suite --sizes all --full       # up to 50 MP, including the slow cases on big images
+    python -m benchmarks.suite --cases ahe,BIE --save-baseline
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from guimg.imaging import convert
+from guimg.jobs import peak_rss, reset_peak_rss
+from guimg.registry import AlgorithmRegistry
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, 'benchmarks', 'results')
+
+# (height, width) of the synthetic images
+SIZES = {
+    'vga': (480, 640),
+    'hd': (1080, 1920),
+    '12mp': (3000, 4000),
+    '50mp': (5792, 8688),
+}
+DEFAULT_SIZES = ('vga', 'hd', '12mp')
+KINDS = ('gray', 'color', 'lowlight')
+# kwargs of the main functions, Zero_DCE needs a memory budget for big images
+MAIN_KWARGS = {'Zero_DCE': {'max_memory_mb': 512}}
+# cases too slow for big images on a CPU run only up to this many pixels, unless --full
+SLOW_CASE_MAX_PIXELS = 1920 * 1080
+# a case is a regression when it takes this much longer than in the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+def synthetic_image(size, kind, seed=0):
+    """ BGR uint8 image with smooth structures and noise, so block and histogram based measures see real content
+
+    Args:
+        size (tuple): (height, width)
+        kind (str): 'gray' (equal channels), 'color' or 'lowlight' (color, most pixels dark)
+    """
+    height, width = size
+    rng = np.random.default_rng(seed)
+    channels = 1 if kind == 'gray' else 3
+    # a coarse random pattern scaled up gives smooth gradients, the noise gives texture
+    coarse = rng.random((8, 8, channels)).astype(np.float32)
+    smooth = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC).reshape(height, width, channels)
+    image = np.clip(smooth * 0.8 + rng.random((height, width, channels), dtype=np.float32) * 0.2, 0, 1)
+    if kind == 'lowlight':
+        image = image ** 3 * 0.35
+    image = (image * 255).astype(np.uint8)
+    return np.repeat(image, 3, axis=2) if channels == 1 else image
+
+
+def _kernels():
+    """ { name: (prepare(bgr image) -> callable, slow) } of the kernels behind the main functions """
+    from algorithms.common import quality
+    from algorithms.common.equalization import hist_equalization
+    from algorithms.preprocessing.Adaptive_Histogram_Equalization import ahe
+
+    def on_gray(kernel):
+        def prepare(image):
+            v = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            return lambda: kernel(v)
+        return prepare
+
+    def lowlight(image):
+        from algorithms.preprocessing.Zero_DCE.lowlight_test import get_session, to_input_tensor
+        session = get_session()
+        tensor = to_input_tensor(convert(image, 'pil'))
+        return lambda: session.enhance(tensor, max_memory_mb=MAIN_KWARGS['Zero_DCE']['max_memory_mb'])
+
+    return {
+        'kernel:hist_equalization': (on_gray(hist_equalization), False),
+        'kernel:ahe': (on_gray(ahe), False),
+        'kernel:AME': (on_gray(lambda v: quality.ame(quality.ImageStatistics(v))), False),
+        'kernel:BIE': (on_gray(lambda v: quality.bie(quality.ImageStatistics(v))), False),
+        'kernel:shannon_entropy': (on_gray(lambda v: quality.shannon_entropy(quality.ImageStatistics(v))), False),
+        'kernel:mean_deviation': (
+            lambda image: lambda: quality.mean_deviation(quality.ImageStatistics(image)), False),
+        'kernel:lowlight': (lowlight, True),
+    }
+
+
+def cases(registry):
+    """ { name: (prepare(bgr image) -> callable, slow) } of all package mains and kernels """
+    found = {}
+    for name, plugin in registry.plugins.items():
+        def prepare(image, name=name):
+            plugin = registry.get(name)
+            source = convert(image, plugin.input_format) if plugin.input_format != 'path' else image
+            kwargs = MAIN_KWARGS.get(name, {})
+            return lambda: plugin.main(source, **kwargs)
+        found[f'main:{name}'] = (prepare, name == 'Zero_DCE')
+    found.update(_kernels())
+    return found
+
+
+def measure(func, repeat):
+    """ Best of repeat seconds and the peak RSS growth in bytes (None where it can't be measured) """
+    func()
+    supported = reset_peak_rss()
+    baseline = peak_rss()
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - began)
+    return min(timings), (peak_rss() - baseline) if supported else None
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY_DIRECTORY,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(case_patterns=None, sizes=DEFAULT_SIZES, kinds=KINDS, repeat=3, full=False):
+    """ Runs the selected cases and returns one result dict per (case, size, kind) """
+    registry = AlgorithmRegistry(os.path.join(REPOSITORY_DIRECTORY, 'algorithms'))
+    selected = {name: case for name, case in cases(registry).items()
+                if not case_patterns or any(fnmatch.fnmatch(name, f'*{pattern}*') for pattern in case_patterns)}
+    results = []
+    for size_name in sizes:
+        height, width = SIZES[size_name]
+        for kind in kinds:
+            image = synthetic_image((height, width), kind)
+            for name, (prepare, slow) in selected.items():
+                if slow and not full and height * width > SLOW_CASE_MAX_PIXELS:
+                    continue
+                try:
+                    seconds, memory = measure(prepare(image), repeat)
+                except Exception as e:
+                    print(f'{name:40s} {size_name:5s} {kind:8s} failed: {type(e).__name__}: {e}')
+                    continue
+                result = {"case": name, "size": size_name, "kind": kind, "seconds": round(seconds, 6),
+                          "megapixels_per_second": round(height * width / 1e6 / seconds, 3),
+                          "peak_memory_mb": round(memory / 2 ** 20, 1) if memory is not None else None}
+                results.append(result)
+                print(f"{name:40s} {size_name:5s} {kind:8s} {seconds * 1000:10.2f} ms "
+                      f"{result['megapixels_per_second']:9.2f} MP/s  +{result['peak_memory_mb']} MB")
+    return results
+
+
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Results slower than the same case in the baseline by more than tolerance, with the slowdown factor """
+    reference = {(r["case"], r["size"], r["kind"]): r["seconds"] for r in baseline["results"]}
+    slower = []
+    for result in results:
+        previous = reference.get((result["case"], result["size"], result["kind"]))
+        if previous and result["seconds"] > previous * (1 + tolerance):
+            slower.append(dict(result, baseline_seconds=previous, slowdown=round(result["seconds"] / previous, 2)))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite", description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", default=None, help="comma separated substrings of the case names to run")
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES), help=f"comma separated of {list(SIZES)} or all")
+    parser.add_argument("--kinds", default=",".join(KINDS), help=f"comma separated of {list(KINDS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the best one counts")
+    parser.add_argument("--full", action="store_true",
+                        help=f"run the slow cases (Zero_DCE) on images above {SLOW_CASE_MAX_PIXELS} pixels too")
+    parser.add_argument("--history", default=os.path.join(RESULTS_DIRECTORY, "history.jsonl"),
+                        help="JSON lines file every run is appended to")
+    parser.add_argument("--baseline", default=os.path.join(RESULTS_DIRECTORY, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="slowdown relative to the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = list(SIZES) if args.sizes == "all" else args.sizes.split(",")
+    results = run(args.cases.split(",") if args.cases else None, sizes, args.kinds.split(","), args.repeat, args.full)
+    record = {"time": time.time(), "revision": git_revision(), "machine": platform.machine(),
+              "processor": platform.processor(), "cpus": os.cpu_count(), "python": platform.python_version(),
+              "numpy": np.__version__, "opencv": cv2.__version__, "results": results}
+
+    os.makedirs(os.path.dirname(args.history), exist_ok=True)
+    with open(args.history, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    status = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for result in slower:
+            print(f"REGRESSION {result['case']} {result['size']} {result['kind']}: {result['seconds'] * 1000:.2f} ms, "
+                  f"{result['slowdown']}x the baseline {result['baseline_seconds'] * 1000:.2f} ms", file=sys.stderr)
+        status = 1 if slower else 0
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(record, f, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
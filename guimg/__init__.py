@@ -0,0 +1 @@
+""" Shared, GUI independent building blocks of the image processor """
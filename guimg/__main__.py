@@ -0,0 +1,5 @@
+import sys
+
+from guimg.cli import main
+
+sys.exit(main())
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+from guimg.imaging import detect_format
+from guimg.tiled import TiledImage
+
+# default size limit of the cache directory
+DEFAULT_MAX_BYTES = 2 * 2 ** 30
+
+
+class ResultCache:
+    """ Persistent on-disk cache of the results of pipeline stages
+
+    A stage result is keyed by the key of its input, the package name, the hash of the package sources
+    (see AlgorithmRegistry.source_hash) and its args/kwargs. The key of the input is the content hash of
+    the original image or the key of the stage that produced it, so a pipeline whose leading stages are
+    unchanged picks up their results from the cache and only runs the stages after the first change.
+
+    Numeric results are stored as JSON, image results as .npy files in the form the package returned them.
+    Tiled results are written band by band and memory-mapped again when they are read.
+    When the cache grows beyond max_bytes the least recently used entries are removed.
+
+    Args:
+        directory (str): where the entries are stored, it is created if needed
+        max_bytes (int, optional): size limit of the stored entries. Defaults to DEFAULT_MAX_BYTES.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # bytes stored so far, scanned on first use
+        self._size = None
+
+    @staticmethod
+    def key(input_key, module_name, source_hash, args=(), kwargs=None):
+        """ Key of the result of module_name run on the input with key input_key """
+        arguments = json.dumps({"args": list(args), "kwargs": kwargs or {}}, sort_keys=True, default=repr)
+        hasher = hashlib.blake2b(digest_size=16)
+        for part in (input_key, module_name, source_hash, arguments):
+            hasher.update(part.encode())
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def _paths(self, key):
+        prefix = os.path.join(self.directory, key[:2], key)
+        return {'number': prefix + '.json', 'bgr': prefix + '.bgr.npy', 'tensor': prefix + '.tensor.npy',
+                'tiled': prefix + '.tiled.npy'}
+
+    def get(self, key):
+        """ Returns the cached result for key, or None on a miss """
+        for kind, path in self._paths(key).items():
+            # tensors can be restored only when torch is in use
+            if kind == 'tensor' and 'torch' not in sys.modules:
+                continue
+            try:
+                if kind == 'number':
+                    with open(path) as f:
+                        result = json.load(f)['value']
+                elif kind == 'tiled':
+                    result = TiledImage.open(path)
+                else:
+                    result = np.load(path)
+            except (OSError, ValueError, KeyError):
+                continue
+            if kind == 'tensor':
+                result = sys.modules['torch'].from_numpy(result)
+            # mark the entry as recently used for the LRU eviction
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.hits += 1
+            return result
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """ Stores a numeric or image result under key """
+        if isinstance(result, (int, float, np.floating)):
+            kind = 'number'
+        else:
+            kind = detect_format(result)
+            if kind not in ('bgr', 'tensor', 'tiled'):
+                return
+        path = self._paths(key)[kind]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so concurrent readers never see a partial entry
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            if kind == 'number':
+                f.write(json.dumps({"value": float(result)}).encode())
+            elif kind == 'tensor':
+                np.save(f, result.detach().cpu().numpy())
+            elif kind == 'tiled':
+                result.save(f)
+            else:
+                np.save(f, result)
+
+        with self._lock:
+            # a rewritten entry replaces the size of the old one
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += os.path.getsize(path) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """ (last use, size, path) of every stored entry """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for parent, _, files in os.walk(self.directory):
+            for file_name in files:
+                if file_name.endswith('.tmp'):
+                    continue
+                path = os.path.join(parent, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        # rescan, other processes may share the directory
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def clear(self):
+        """ Removes all entries and resets the hit/miss counters """
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self._size = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """ dict with the hits, misses, number of entries and stored bytes """
+        with self._lock:
+            entries = self._entries()
+            self._size = sum(size for _, size, _ in entries)
+            return {"hits": self.hits, "misses": self.misses, "entries": len(entries), "bytes": self._size}
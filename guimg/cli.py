@@ -0,0 +1,167 @@
+""" Headless command line interface, runs the algorithm pipeline over many images without the GUI
+
+Example:
+    python -m guimg run "frames/*.png" --pipeline '{"Zero_DCE": {}, "BIE": {"kwargs": {"block_size": 15}}}' -o out
+    python -m guimg stream clip.mp4 --pipeline '["Zero_DCE", "BIE"]' -o out
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+from guimg.executor import BatchExecutor, output_directories_for
+from guimg.graph import is_graph_spec, parse_graph
+from guimg.stream import DEFAULT_QUEUE_SIZE, DEFAULT_SEQUENCE_FPS, FrameSource, process_stream
+from guimg.sweep import Sweep, is_sweep
+from guimg.registry import AlgorithmRegistry
+
+DEFAULT_ALGORITHMS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'algorithms')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def load_pipeline_spec(spec):
+    """ Parses the pipeline spec given as JSON text or as a path to a JSON file
+
+    The spec has { module_name: {"args": [...], "kwargs": {...}} } structure, the same as function_args in the GUI.
+    A list of module names is accepted as a shorthand for modules without args/kwargs.
+    A spec with a "nodes" entry describes a graph, see guimg.graph.parse_graph. Args/kwargs can be swept,
+    see guimg.sweep.
+    """
+    if os.path.isfile(spec):
+        with open(spec, "r") as f:
+            spec = f.read()
+    parsed = json.loads(spec)
+    if isinstance(parsed, list):
+        parsed = {name: {} for name in parsed}
+    return parsed
+
+
+def expand_inputs(patterns):
+    """ Expands globs and directories into a sorted list of image paths, keeping the order of the patterns """
+    paths = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                paths.setdefault(path)
+    return list(paths)
+
+
+def run(args):
+    registry = AlgorithmRegistry(args.algorithms_dir)
+    function_args = load_pipeline_spec(args.pipeline)
+    if is_graph_spec(function_args):
+        try:
+            parse_graph(function_args, registry)
+        except ValueError as e:
+            raise SystemExit(str(e))
+    else:
+        unknown = [name for name in function_args if name not in registry.plugins]
+        if unknown:
+            raise SystemExit(f"Unknown algorithm(s): {', '.join(unknown)}")
+        if is_sweep(function_args):
+            # every combination of the swept values, as a graph running their common stages once
+            function_args = Sweep(registry, list(function_args), function_args, not args.no_pipeline).spec()
+
+    image_paths = expand_inputs(args.inputs)
+    if not image_paths:
+        raise SystemExit("No input images matched.")
+    try:
+        output_directories_for(args.output, image_paths)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    os.makedirs(args.output, exist_ok=True)
+    executor = BatchExecutor(args.algorithms_dir, function_args, pipeline=not args.no_pipeline,
+                             output_dir=args.output, workers=args.workers,
+                             threads_per_worker=args.threads_per_worker, batch_size=args.batch_size,
+                             cache_dir=args.cache, cache_max_bytes=int(args.cache_size * 2 ** 20))
+    failures = 0
+    # one JSON line per image, written as soon as the image is done
+    with open(os.path.join(args.output, "results.jsonl"), "w") as results_file:
+        for index, record in enumerate(executor.map(image_paths), 1):
+            if "error" in record:
+                failures += 1
+                print(f"{record['image']}: {record['error']}", file=sys.stderr)
+            results_file.write(json.dumps(record) + "\n")
+            results_file.flush()
+            print(f"[{index}/{len(image_paths)}] {record['image']}")
+
+    return 1 if failures else 0
+
+
+def stream(args):
+    registry = AlgorithmRegistry(args.algorithms_dir)
+    function_args = load_pipeline_spec(args.pipeline)
+    if is_graph_spec(function_args) or is_sweep(function_args):
+        raise SystemExit("Videos are processed with a flat pipeline, graphs and sweeps are not supported.")
+    unknown = [name for name in function_args if name not in registry.plugins]
+    if unknown:
+        raise SystemExit(f"Unknown algorithm(s): {', '.join(unknown)}")
+
+    os.makedirs(args.output, exist_ok=True)
+    source = FrameSource(args.input, args.fps)
+
+    def on_frame(index, results):
+        print(f"[{index + 1}/{source.frame_count or '?'}] {json.dumps(results)}")
+
+    report = process_stream(registry, source, list(function_args), function_args, pipeline=not args.no_pipeline,
+                            output_video=os.path.join(args.output, "enhanced.mp4"),
+                            metrics_csv=os.path.join(args.output, "metrics.csv"), batch_size=args.batch_size,
+                            queue_size=args.queue_size, on_frame=on_frame)
+    with open(os.path.join(args.output, "stream.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{report['frames']} frames in {report['seconds']:.2f}s, {report['fps']} fps")
+    for name, stats in report["stages"].items():
+        print(f"  {name:8s} {stats['fps']} fps, busy {stats['seconds']:.2f}s")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m guimg", description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the algorithm pipeline over images")
+    run_parser.add_argument("inputs", nargs="+", help="image paths, directories or glob patterns")
+    run_parser.add_argument("-p", "--pipeline", required=True,
+                            help='JSON text or file: {"<module>": {"args": [], "kwargs": {}}, ...} or a graph '
+                                 '{"nodes": {"<name>": {"module": "<module>", "input": "<name>", ...}, ...}}')
+    run_parser.add_argument("-o", "--output", required=True, help="directory for the output images and results")
+    run_parser.add_argument("--no-pipeline", action="store_true",
+                            help="give every algorithm the original image instead of the previous result")
+    run_parser.add_argument("-j", "--workers", type=int, default=None,
+                            help="number of worker processes, defaults to the number of cores")
+    run_parser.add_argument("--threads-per-worker", type=int, default=1,
+                            help="threads each worker lets cv2/torch use")
+    run_parser.add_argument("-b", "--batch-size", type=int, default=1,
+                            help="images each worker runs through the pipeline together, see main_batch")
+    run_parser.add_argument("--cache", default=None,
+                            help="directory to cache stage results in, unchanged stages are not run again")
+    run_parser.add_argument("--cache-size", type=float, default=2048, help="size limit of the cache in MB")
+    run_parser.add_argument("--algorithms-dir", default=DEFAULT_ALGORITHMS_DIRECTORY)
+    run_parser.set_defaults(func=run)
+
+    stream_parser = subparsers.add_parser("stream", help="run the algorithm pipeline over the frames of a video")
+    stream_parser.add_argument("input", help="video file, numbered sequence (frames/%%04d.png), glob or directory")
+    stream_parser.add_argument("-p", "--pipeline", required=True,
+                               help='JSON text or file: {"<module>": {"args": [], "kwargs": {}}, ...}')
+    stream_parser.add_argument("-o", "--output", required=True,
+                               help="directory for enhanced.mp4, metrics.csv (one row per frame) and stream.json")
+    stream_parser.add_argument("--no-pipeline", action="store_true",
+                               help="give every algorithm the decoded frame instead of the previous result")
+    stream_parser.add_argument("-b", "--batch-size", type=int, default=1,
+                               help="frames run through the algorithms together, see main_batch")
+    stream_parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                               help="batches that may wait between two stages, bounds the memory")
+    stream_parser.add_argument("--fps", type=float, default=DEFAULT_SEQUENCE_FPS,
+                               help="frame rate of image sequences, videos keep their own")
+    stream_parser.add_argument("--algorithms-dir", default=DEFAULT_ALGORITHMS_DIRECTORY)
+    stream_parser.set_defaults(func=stream)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
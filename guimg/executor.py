@@ -0,0 +1,183 @@
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from guimg.cache import DEFAULT_MAX_BYTES, ResultCache
+from guimg.graph import is_graph_spec, module_names, parse_graph, run_graph
+from guimg.imaging import save_image
+from guimg.pipeline import run_pipeline_batch
+from guimg.registry import AlgorithmRegistry
+
+# state of a worker process, set up once by _init_worker and reused for every image the process handles
+_worker = {}
+
+
+def output_directories_for(output_dir, image_paths):
+    """ { image_path: directory its image results are written to }, a different one for every image
+
+    The directory is the path of the image relative to the common directory of all images, without the extension:
+    a/0001.png and b/0001.png go to <output_dir>/a/0001 and <output_dir>/b/0001. Images differing only in the
+    extension keep it, x.png and x.jpg go to <output_dir>/x.png and <output_dir>/x.jpg.
+
+    Raises:
+        ValueError: if two images would still share a directory
+    """
+    paths = {image_path: os.path.abspath(image_path) for image_path in image_paths}
+    if not paths:
+        return {}
+    root = os.path.commonpath([os.path.dirname(path) for path in paths.values()])
+    relative = {image_path: os.path.relpath(path, root) for image_path, path in paths.items()}
+    stems = Counter(os.path.splitext(path)[0] for path in relative.values())
+    directories = {}
+    for image_path, path in relative.items():
+        stem = os.path.splitext(path)[0]
+        directories[image_path] = os.path.join(output_dir, stem if stems[stem] == 1 else path)
+    shared = [directory for directory, count in Counter(directories.values()).items() if count > 1]
+    if shared:
+        raise ValueError(f"Images would overwrite each other's results in {', '.join(shared)}")
+    return directories
+
+
+def limit_threads(threads):
+    """ Caps the thread pools of the numeric libraries, so worker processes don't oversubscribe the cores """
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[variable] = str(threads)
+    if 'cv2' in sys.modules:
+        sys.modules['cv2'].setNumThreads(threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+
+
+def warm_up(registry, module_names):
+    """ Imports the packages and calls their optional warmup() hook, e.g. to load model weights """
+    for name in module_names:
+        warmup = getattr(registry.get(name).module, 'warmup', None)
+        if warmup is not None:
+            warmup()
+
+
+def spec_module_names(function_args):
+    """ The packages a flat or graph pipeline spec runs, see guimg.graph """
+    return module_names(parse_graph(function_args)) if is_graph_spec(function_args) else list(function_args)
+
+
+def process_image_files(registry, image_paths, function_args, pipeline=True, output_dir=None, cache=None,
+                        graph_workers=None, directories=None):
+    """ Runs the pipeline on a batch of image files and writes their image results to output_dir
+
+    function_args can also be a graph spec (see guimg.graph.parse_graph), the graph then runs image by image
+    with up to graph_workers of its nodes at the same time. The results of every image go to its directory in
+    directories, computed from all images of a run by output_directories_for (from image_paths if None).
+
+    Returns:
+        : list with a {"image": image_path, "results": {...}} or {"image": image_path, "error": "..."} dict per image
+    """
+    if output_dir is not None and directories is None:
+        directories = output_directories_for(output_dir, image_paths)
+
+    def on_image(index, module_name, image):
+        if output_dir is not None:
+            save_image(image.get('bgr'), os.path.join(directories[image_paths[index]], f"{module_name}.png"))
+
+    if is_graph_spec(function_args):
+        nodes = parse_graph(function_args)
+        outcomes = []
+        for index, image_path in enumerate(image_paths):
+            try:
+                outcomes.append(run_graph(registry, image_path, nodes, verbose=False, cache=cache, workers=graph_workers,
+                                          on_image=lambda name, image, index=index: on_image(index, name, image)))
+            except Exception as e:
+                outcomes.append(e)
+    else:
+        outcomes = run_pipeline_batch(registry, image_paths, list(function_args), function_args,
+                                      pipeline=pipeline, on_image=on_image, cache=cache)
+    records = []
+    for image_path, outcome in zip(image_paths, outcomes):
+        if isinstance(outcome, Exception):
+            records.append({"image": image_path, "error": f"{type(outcome).__name__}: {outcome}"})
+        else:
+            records.append({"image": image_path, "results": outcome})
+    return records
+
+
+def _open_cache(cache_dir, cache_max_bytes):
+    return ResultCache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+
+
+def _init_worker(algorithms_directory, function_args, pipeline, output_dir, threads, cache_dir, cache_max_bytes):
+    # before warming up, so torch and the BLAS libraries start with the capped pools and the warm-ups of
+    # all workers don't run with full-size ones at the same time
+    limit_threads(threads)
+    registry = AlgorithmRegistry(algorithms_directory)
+    warm_up(registry, spec_module_names(function_args))
+    _worker.update(registry=registry, function_args=function_args, pipeline=pipeline, output_dir=output_dir,
+                   cache=_open_cache(cache_dir, cache_max_bytes), threads=threads)
+
+
+def _process_in_worker(image_paths, directories):
+    return process_image_files(_worker['registry'], image_paths, _worker['function_args'], _worker['pipeline'],
+                               _worker['output_dir'], _worker['cache'], _worker['threads'], directories)
+
+
+class BatchExecutor:
+    """ Runs the pipeline over many images, spread across worker processes
+
+    Every worker imports the packages and warms them up once, then processes its share of the images.
+    Results are yielded in input order.
+
+    Args:
+        algorithms_directory (str): path to the algorithms directory
+        function_args (dict): { module_name: {"args": [...], "kwargs": {...}} } of the packages to run,
+            or a graph spec, see guimg.graph.parse_graph
+        pipeline (bool, optional): hand the image result of each package to the next one. Defaults to True.
+        output_dir (str, optional): where image results are written, they are not written if None.
+            See output_directories_for for the directory of every image.
+        workers (int, optional): number of worker processes, 1 runs in the calling process. Defaults to the core count.
+        threads_per_worker (int, optional): threads each worker lets cv2/torch use. Defaults to 1.
+        batch_size (int, optional): images a worker runs through the pipeline together, packages with
+            a main_batch function (e.g. Zero_DCE) process them in one call. Defaults to 1.
+        cache_dir (str, optional): directory of a ResultCache shared by the workers, stages already run
+            with the same input, package sources and args are not run again. Defaults to None, no cache.
+        cache_max_bytes (int, optional): size limit of the cache. Defaults to guimg.cache.DEFAULT_MAX_BYTES.
+    """
+
+    def __init__(self, algorithms_directory, function_args, pipeline=True, output_dir=None, workers=None,
+                 threads_per_worker=1, batch_size=1, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES):
+        self.algorithms_directory = algorithms_directory
+        self.function_args = function_args
+        self.pipeline = pipeline
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.threads_per_worker = threads_per_worker
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+
+    def map(self, image_paths):
+        """ Yields one result record per image, see process_image_files
+
+        Raises:
+            ValueError: if two images would write their results to the same directory, see output_directories_for
+        """
+        image_paths = list(image_paths)
+        # from all images up front, the batches don't see each other
+        directories = output_directories_for(self.output_dir, image_paths) if self.output_dir is not None else {}
+        batches = [image_paths[i:i + self.batch_size] for i in range(0, len(image_paths), self.batch_size)]
+        batch_directories = [{image_path: directories.get(image_path) for image_path in batch} for batch in batches]
+        if self.workers == 1:
+            registry = AlgorithmRegistry(self.algorithms_directory)
+            warm_up(registry, spec_module_names(self.function_args))
+            cache = _open_cache(self.cache_dir, self.cache_max_bytes)
+            for batch, batch_directory in zip(batches, batch_directories):
+                yield from process_image_files(registry, batch, self.function_args, self.pipeline, self.output_dir,
+                                               cache, directories=batch_directory)
+            return
+
+        # big enough chunks to amortize the inter process overhead, small enough to keep all workers busy
+        chunksize = max(1, min(32, len(batches) // (self.workers * 4)))
+        initargs = (self.algorithms_directory, self.function_args, self.pipeline, self.output_dir,
+                    self.threads_per_worker, self.cache_dir, self.cache_max_bytes)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=initargs) as pool:
+            for records in pool.map(_process_in_worker, batches, batch_directories, chunksize=chunksize):
+                yield from records
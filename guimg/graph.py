@@ -0,0 +1,222 @@
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from guimg.imaging import ImageData
+from guimg.pipeline import UnexpectedResultError, is_image_result, is_numeric_result, run_stage
+
+# name under which nodes read the input image, nodes without an "input" read it
+INPUT = 'image'
+# packages of these categories measure the image, in a flat pipeline they see the last image result
+# without replacing it, so consecutive measures don't depend on each other
+MEASURE_CATEGORIES = ('quality_measures',)
+
+
+class Node:
+    """ A stage of a pipeline graph, runs a package on the output of another node or on the input image
+
+    Args:
+        name (str): unique name of the node, results are reported under it
+        module_name (str): package to run
+        input (str, optional): node whose output the package gets. Defaults to INPUT, the input image.
+        args (list, optional): args passed to the main function
+        kwargs (dict, optional): kwargs passed to the main function
+    """
+
+    def __init__(self, name, module_name, input=INPUT, args=(), kwargs=None):
+        self.name = name
+        self.module_name = module_name
+        self.input = input
+        self.args = list(args)
+        self.kwargs = kwargs or {}
+
+    def __repr__(self):
+        return f'Node({self.name!r}, {self.module_name!r}, input={self.input!r})'
+
+
+def is_graph_spec(spec):
+    """ Graph specs have a "nodes" entry, flat specs map package names to their args/kwargs """
+    return isinstance(spec, dict) and isinstance(spec.get('nodes'), dict)
+
+
+def _topological_order(nodes):
+    ordered = {}
+    visiting = set()
+
+    def visit(node):
+        if node.name in ordered:
+            return
+        if node.name in visiting:
+            raise ValueError(f"The pipeline graph has a cycle through {node.name}")
+        visiting.add(node.name)
+        if node.input != INPUT:
+            visit(nodes[node.input])
+        visiting.discard(node.name)
+        ordered[node.name] = node
+
+    for node in nodes.values():
+        visit(node)
+    return ordered
+
+
+def parse_graph(spec, registry=None):
+    """ Builds the nodes of a graph spec
+
+    The spec has {"nodes": { node_name: {"module": ..., "input": ..., "args": [...], "kwargs": {...}} }} structure,
+    "module" defaults to the node name and "input" to the input image. For example
+        {"nodes": {"Zero_DCE": {}, "Adaptive_Histogram_Equalization": {},
+                   "BIE of Zero_DCE": {"module": "BIE", "input": "Zero_DCE"},
+                   "BIE of AHE": {"module": "BIE", "input": "Adaptive_Histogram_Equalization"}}}
+    measures BIE on both the Zero_DCE and the AHE output. A node reading a node with a numeric result gets the
+    image that node measured.
+
+    Args:
+        spec (dict): the graph spec
+        registry (AlgorithmRegistry, optional): if given, the packages are checked to exist
+
+    Raises:
+        ValueError: if a node reads an unknown node, the graph has a cycle or a package is unknown
+
+    Returns:
+        : dict with { node_name: Node } structure, every node comes after the node it reads
+    """
+    nodes = {}
+    for name, node_spec in spec['nodes'].items():
+        if name == INPUT:
+            raise ValueError(f"'{INPUT}' is the input image, it can't be the name of a node")
+        nodes[name] = Node(name, node_spec.get('module', name), node_spec.get('input', INPUT),
+                           node_spec.get('args', []), node_spec.get('kwargs', {}))
+    for node in nodes.values():
+        if node.input != INPUT and node.input not in nodes:
+            raise ValueError(f"Node {node.name} reads the unknown node {node.input}")
+        if registry is not None and node.module_name not in registry.plugins:
+            raise ValueError(f"Node {node.name} runs the unknown algorithm {node.module_name}")
+    return _topological_order(nodes)
+
+
+def linear_graph(registry, module_names, function_args=None, pipeline=True):
+    """ The graph of a flat list of packages, the way run_pipeline runs them
+
+    With pipeline every package reads the last image result before it, otherwise all of them read the input image.
+    Measures (see MEASURE_CATEGORIES) reading the same image are independent and run concurrently.
+
+    Returns:
+        : dict with { module_name: Node } structure
+    """
+    function_args = function_args or {}
+    nodes = {}
+    previous = INPUT
+    for module_name in registry.sort(module_names):
+        func_args = function_args.get(module_name, {})
+        nodes[module_name] = Node(module_name, module_name, previous if pipeline else INPUT,
+                                  func_args.get('args', []), func_args.get('kwargs', {}))
+        if pipeline and registry.plugins[module_name].category not in MEASURE_CATEGORIES:
+            previous = module_name
+    return nodes
+
+
+def module_names(nodes):
+    """ The packages the nodes run, each once """
+    return list(dict.fromkeys(node.module_name for node in nodes.values()))
+
+
+def run_graph(registry, image, nodes, on_image=None, on_result=None, verbose=True, cache=None, job=None, tracer=None,
+              workers=None):
+    """ Runs a pipeline graph, nodes whose input is ready run concurrently on a thread pool
+
+    The output of every node is computed once and handed to all nodes reading it. It is released as soon as the
+    last of them has finished, so only the images still needed stay in memory. Packages spend their time in
+    numpy, cv2 and torch, which release the GIL, so threads run them in parallel without copying the images.
+
+    Args:
+        registry (AlgorithmRegistry): registry the packages are loaded from
+        image : input image in any of guimg.imaging.IMAGE_FORMATS
+        nodes (dict): { node_name: Node }, see parse_graph and linear_graph
+        on_image (callable, optional): called with (node_name, ImageData) as soon as a node returns an image,
+            from the thread that ran it
+        on_result (callable, optional): called with (node_name, float) as soon as a node returns a number
+        verbose (bool, optional): print progress. Defaults to True.
+        cache (ResultCache, optional): node results are looked up in and stored to it, see guimg.cache
+        job (Job, optional): the nodes run inside job.stage, see run_pipeline
+        tracer (Tracer, optional): reports every node to it, see guimg.instrumentation
+        workers (int, optional): nodes running at the same time. Defaults to the core count, 1 when the tracer
+            profiles with 'cprofile'.
+
+    Raises:
+        UnexpectedResultError: if a main function returns neither a number nor an image
+        Cancelled: if the job is cancelled
+
+    Returns:
+        : dict with { node_name: float } structure holding the numeric results
+    """
+    results = {}
+    # outputs of the finished nodes still read by a node that hasn't finished
+    outputs = {INPUT: image if isinstance(image, ImageData) else ImageData(image)}
+    readers = {name: [] for name in [INPUT, *nodes]}
+    for node in nodes.values():
+        readers[node.input].append(node)
+    unfinished = {name: len(nodes_reading) for name, nodes_reading in readers.items()}
+    index = {name: position for position, name in enumerate(nodes)}
+    lock = threading.Lock()
+
+    def run_node(node, source):
+        if verbose:
+            print(f'performing {node.name}...')
+
+        def handle(result, key):
+            if is_numeric_result(result):
+                with lock:
+                    results[node.name] = float(result)
+                if on_result is not None:
+                    on_result(node.name, float(result))
+                # nodes reading a measure get the image it measured
+                return source
+            if is_image_result(result):
+                result_image = ImageData(result, key)
+                if on_image is not None:
+                    on_image(node.name, result_image)
+                return result_image
+            raise UnexpectedResultError(f"Unexpected result type {type(result)} from module {node.module_name}")
+
+        output = run_stage(registry, node.name, node.module_name, source, node.args, node.kwargs, handle, cache, job,
+                           tracer, index[node.name], len(nodes))
+        if verbose:
+            print(f'finished {node.name}')
+        return output
+
+    def release(name):
+        unfinished[name] -= 1
+        if unfinished[name] == 0:
+            outputs.pop(name, None)
+
+    if tracer is not None and tracer.profile == 'cprofile':
+        # only one cProfile profiler can be active at a time (python 3.12+), so the nodes are profiled one by one
+        workers = 1
+    error = None
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix='pipeline') as pool:
+        running = {pool.submit(run_node, node, outputs[INPUT]): node for node in readers[INPUT]}
+        if not running:
+            outputs.pop(INPUT)
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                release(node.input)
+                try:
+                    output = future.result()
+                except Exception as e:
+                    # let the running nodes stop at their next checkpoint and don't start new ones
+                    error = error or e
+                    if job is not None:
+                        job.cancel()
+                    continue
+                if error is not None:
+                    continue
+                if unfinished[node.name]:
+                    outputs[node.name] = output
+                for reader in readers[node.name]:
+                    running[pool.submit(run_node, reader, output)] = reader
+    if error is not None:
+        raise error
+
+    return {name: results[name] for name in nodes if name in results}
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import weakref
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from guimg.tiled import TILED_EXTENSIONS, TiledImage, open_tiled
+
+# forms in which an image can be handed to the main function of an algorithm package
+#   path   - path to an image file on disk
+#   bgr    - HxWx3 uint8 numpy array in BGR order (what cv2.imread returns)
+#   pil    - RGB PIL image
+#   tensor - float torch tensor in RGB order with values in [0, 1], shaped 3xHxW or 1x3xHxW
+#   tiled  - guimg.tiled.TiledImage, a memory-mapped image read piece by piece, only handed to packages
+#            declaring TILED_INPUT = True
+IMAGE_FORMATS = ('path', 'bgr', 'pil', 'tensor', 'tiled')
+
+
+def _is_tensor(image):
+    # torch is only imported by the packages which need it,
+    # if it was never imported the image can't be a tensor
+    torch = sys.modules.get('torch')
+    return torch is not None and isinstance(image, torch.Tensor)
+
+
+def detect_format(image):
+    """ Returns which of IMAGE_FORMATS the given image is in """
+    if isinstance(image, (str, os.PathLike)):
+        return 'path'
+    if isinstance(image, TiledImage):
+        return 'tiled'
+    if isinstance(image, np.ndarray):
+        return 'bgr'
+    if isinstance(image, Image.Image):
+        return 'pil'
+    if _is_tensor(image):
+        return 'tensor'
+    raise TypeError(f"Unsupported image type {type(image)}")
+
+
+def _tensor_to_rgb(tensor):
+    import torch
+
+    # same quantization as torchvision.utils.save_image, so converting in memory
+    # gives exactly the pixels a save/load round trip through a PNG would
+    if tensor.dim() == 4:
+        tensor = tensor.squeeze(0)
+    return tensor.detach().mul(255).add_(0.5).clamp_(0, 255).permute(1, 2, 0).to('cpu', torch.uint8).numpy()
+
+
+def to_bgr(image):
+    fmt = detect_format(image)
+    if fmt == 'path':
+        if os.fspath(image).lower().endswith('.npy'):
+            return TiledImage.open(image).to_array()
+        return cv2.imread(os.fspath(image), 1)
+    if fmt == 'tiled':
+        return image.to_array()
+    if fmt == 'bgr':
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return image
+    if fmt == 'pil':
+        return cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+    return cv2.cvtColor(_tensor_to_rgb(image), cv2.COLOR_RGB2BGR)
+
+
+def to_pil(image):
+    fmt = detect_format(image)
+    if fmt == 'path':
+        return Image.open(image).convert('RGB')
+    if fmt == 'pil':
+        return image.convert('RGB') if image.mode != 'RGB' else image
+    if fmt == 'tensor':
+        return Image.fromarray(_tensor_to_rgb(image))
+    return Image.fromarray(cv2.cvtColor(to_bgr(image), cv2.COLOR_BGR2RGB))
+
+
+def to_tensor(image):
+    import torch
+
+    if detect_format(image) == 'tensor':
+        return image if image.dim() == 4 else image.unsqueeze(0)
+    rgb = np.asarray(to_pil(image)) / 255.0
+    return torch.from_numpy(rgb).float().permute(2, 0, 1).unsqueeze(0)
+
+
+def to_tiled(image):
+    return TiledImage.from_array(to_bgr(image))
+
+
+_CONVERTERS = {'bgr': to_bgr, 'pil': to_pil, 'tensor': to_tensor, 'tiled': to_tiled}
+
+
+def convert(image, fmt):
+    """ Converts the image to the given format, returns it unchanged if it is already in that format
+
+    Args:
+        image : image in any of IMAGE_FORMATS
+        fmt (str): one of IMAGE_FORMATS except 'path', use save_image to get an image on disk
+
+    Returns:
+        : the image in the requested format
+    """
+    if detect_format(image) == fmt:
+        return image
+    return _CONVERTERS[fmt](image)
+
+
+def save_image(image, path):
+    """ Writes an image in any of IMAGE_FORMATS to path """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    cv2.imwrite(path, to_bgr(image))
+    return path
+
+
+class ImageData:
+    """ An image handed from one pipeline stage to the next
+
+    The image is kept in memory in the form it was produced in and converted to another form
+    only when a stage asks for it. Every conversion is done at most once and reused by later stages.
+    Packages which only measure the image keep the intermediates they share in shared.
+    """
+
+    def __init__(self, image, key=None):
+        # the form the image came in, the others are derived from it
+        self._origin = detect_format(image)
+        self._forms = {self._origin: image}
+        # .npy and TIFF files are mapped instead of decoded, packages reading them tile by tile never load them whole
+        if self._origin == 'path' and os.fspath(image).lower().endswith(TILED_EXTENSIONS):
+            tiled = open_tiled(image)
+            if tiled is not None:
+                self._forms['tiled'] = tiled
+        # cache key of the pipeline stage that produced the image, see guimg.cache.ResultCache
+        self.key = key
+        # intermediate results of the packages that see this image, see guimg.pipeline.call_main
+        self.shared = {}
+        self._fingerprint = None
+        # stages reading the image concurrently convert it once
+        self._lock = threading.Lock()
+
+    def fingerprint(self):
+        """ Hash of the image content, files are hashed as they are on disk without decoding them """
+        with self._lock:
+            if self._fingerprint is None:
+                hasher = hashlib.blake2b(digest_size=16)
+                if self._origin == 'path':
+                    with open(self._forms['path'], 'rb') as f:
+                        for chunk in iter(lambda: f.read(2 ** 20), b''):
+                            hasher.update(chunk)
+                elif self._origin == 'tiled':
+                    tiled = self._forms['tiled']
+                    hasher.update(f'bgr:uint8:{tiled.shape}'.encode())
+                    for top, bottom in tiled.bands():
+                        hasher.update(tiled.read(top, bottom))
+                else:
+                    fmt = next(fmt for fmt in ('bgr', 'tensor', 'pil') if fmt in self._forms)
+                    array = self._forms[fmt]
+                    if fmt == 'tensor':
+                        array = array.detach().cpu().numpy()
+                    array = np.ascontiguousarray(array)
+                    hasher.update(f'{fmt}:{array.dtype}:{array.shape}'.encode())
+                    hasher.update(memoryview(array).cast('B'))
+                self._fingerprint = hasher.hexdigest()
+            return self._fingerprint
+
+    def get(self, fmt):
+        with self._lock:
+            if fmt not in self._forms:
+                if fmt == 'path':
+                    self._forms[fmt] = self._write_tmp()
+                else:
+                    self._forms[fmt] = convert(self._source(), fmt)
+            return self._forms[fmt]
+
+    def has(self, fmt):
+        """ Whether the image is already held in the given form """
+        return fmt in self._forms
+
+    def _source(self):
+        # prefer an already decoded form, decoding from disk is the most expensive conversion
+        for fmt in ('bgr', 'pil', 'tensor', 'tiled', 'path'):
+            if fmt in self._forms:
+                return self._forms[fmt]
+
+    def _write_tmp(self):
+        # only needed for packages which read their input from disk
+        fd, path = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        # removed once the image is no longer referenced, or at exit at the latest
+        weakref.finalize(self, _remove_file, path)
+        return save_image(self._source(), path)
+
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,196 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from guimg.imaging import detect_format
+from guimg.jobs import current_rss
+
+PROFILERS = (None, 'cprofile', 'sampling')
+
+
+def payload_bytes(value):
+    """ Size in bytes of an image or result handed into or out of a package, 0 if unknown """
+    if isinstance(value, (int, float)):
+        return 8
+    try:
+        fmt = detect_format(value)
+    except TypeError:
+        return getattr(value, 'nbytes', 0)
+    if fmt == 'path':
+        return os.path.getsize(value) if os.path.exists(value) else 0
+    if fmt == 'pil':
+        return value.width * value.height * len(value.getbands())
+    if fmt == 'tensor':
+        return value.element_size() * value.nelement()
+    return value.nbytes
+
+
+class SamplingProfiler:
+    """ Samples the stack of one thread at a fixed interval from a background thread
+
+    Stacks are kept in the collapsed format ("outer;inner;innermost count" per line) that py-spy
+    (--format raw), flamegraph.pl and speedscope read.
+
+    Args:
+        thread_id (int): ident of the thread to sample
+        interval (float, optional): seconds between samples. Defaults to 0.005.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class Tracer:
+    """ Instrumentation of the pipeline call site, no changes to the packages needed
+
+    run_pipeline reports every stage to the tracer, split into phases: load (importing the package),
+    cache (result cache lookup), decode (converting the image into the package's INPUT_FORMAT),
+    compute (main/measure) and encode (storing the result and handing it to on_image/on_result).
+    Per stage an event dict is kept with the seconds of every phase, the bytes handed in and out
+    and the RSS growth, and passed to the listeners.
+
+    Args:
+        profile (str, optional): profile the compute phase of every stage with 'cprofile' or 'sampling'
+            (collapsed stacks, see SamplingProfiler). Only one cProfile profiler can be active at a time, so with
+            'cprofile' run_graph runs the stages one after the other, use 'sampling' to profile them in parallel.
+            Defaults to None.
+        listeners (list, optional): callables called with the event dict of every finished stage
+    """
+
+    def __init__(self, profile=None, listeners=()):
+        if profile not in PROFILERS:
+            raise ValueError(f"profile must be one of {PROFILERS}, not {profile!r}")
+        self.profile = profile
+        self.listeners = list(listeners)
+        self.events = []
+        # { module name: cProfile.Profile or SamplingProfiler } of the profiled stages
+        self.profiles = {}
+        self._trace = []
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _timestamp(self):
+        return (time.perf_counter() - self._origin) * 1e6
+
+    @contextmanager
+    def stage(self, module_name):
+        """ Wraps a whole stage, yields its event dict which the pipeline adds bytes_in/bytes_out to """
+        event = {"module": module_name, "phases": {}, "bytes_in": 0, "bytes_out": 0}
+        rss_before = current_rss()
+        began = self._timestamp()
+        self._local.event = event
+        try:
+            yield event
+        finally:
+            self._local.event = None
+            duration = self._timestamp() - began
+            rss_after = current_rss()
+            event["seconds"] = duration / 1e6
+            event["memory_delta"] = rss_after - rss_before if rss_before is not None else None
+            self._record(module_name, 'stage', began, duration, {key: value for key, value in event.items()
+                                                                  if key != "phases"})
+            with self._lock:
+                self.events.append(event)
+            for listener in self.listeners:
+                listener(event)
+
+    def note(self, **values):
+        """ Adds values (e.g. bytes_in) to the event of the current stage """
+        event = getattr(self._local, 'event', None)
+        if event is not None:
+            event.update(values)
+
+    @contextmanager
+    def phase(self, name):
+        """ Times a phase of the current stage, the compute phase is profiled if profile is set """
+        event = getattr(self._local, 'event', None)
+        profiler = None
+        if name == 'compute' and self.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif name == 'compute' and self.profile == 'sampling':
+            profiler = SamplingProfiler(threading.get_ident()).start()
+        began = self._timestamp()
+        try:
+            yield
+        finally:
+            duration = self._timestamp() - began
+            if profiler is not None:
+                if self.profile == 'cprofile':
+                    profiler.disable()
+                else:
+                    profiler.stop()
+                if event is not None:
+                    with self._lock:
+                        self.profiles[event["module"]] = profiler
+            if event is not None:
+                event["phases"][name] = event["phases"].get(name, 0.0) + duration / 1e6
+                self._record(event["module"], name, began, duration)
+
+    def _record(self, module_name, name, began, duration, args=None):
+        entry = {"name": name if name != 'stage' else module_name, "cat": module_name, "ph": "X",
+                 "ts": round(began, 1), "dur": round(duration, 1), "pid": os.getpid(), "tid": threading.get_ident()}
+        if args:
+            entry["args"] = args
+        with self._lock:
+            self._trace.append(entry)
+
+    def chrome_trace(self):
+        """ The stages and phases in the Chrome trace event format, for chrome://tracing or ui.perfetto.dev """
+        with self._lock:
+            return {"traceEvents": list(self._trace), "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+    def write_profiles(self, directory):
+        """ Writes <module>.prof (pstats, e.g. for snakeviz) or <module>.folded (collapsed stacks) per stage """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        with self._lock:
+            profiles = dict(self.profiles)
+        for module_name, profiler in profiles.items():
+            if isinstance(profiler, cProfile.Profile):
+                path = os.path.join(directory, f"{module_name}.prof")
+                profiler.dump_stats(path)
+            else:
+                path = os.path.join(directory, f"{module_name}.folded")
+                with open(path, "w") as f:
+                    f.write(profiler.collapsed())
+            paths.append(path)
+        return paths
@@ -0,0 +1,159 @@
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# the job whose stage the current thread is running, see current_job
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    """ Raised inside a job once it has been cancelled, at the next checkpoint """
+
+
+def reset_peak_rss():
+    """ Resets the peak RSS of the process to its current RSS, returns False where that isn't supported """
+    try:
+        # Linux only, writing 5 resets VmHWM
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _status_bytes(field):
+    """ A memory field of /proc/self/status in bytes, None where there is no /proc """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss():
+    """ Resident set size of the process in bytes, None where it can't be read """
+    return _status_bytes('VmRSS:')
+
+
+def peak_rss():
+    """ Peak resident set size of the process in bytes, since the last reset where supported """
+    peak = _status_bytes('VmHWM:')
+    if peak is not None:
+        return peak
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Job:
+    """ Handle of a running pipeline, shared by the threads running it and the thread controlling it
+
+    The pipeline runs every stage inside job.stage(...), which checks for cancellation, reports progress
+    and records the wall time, CPU time and peak RSS of the stage (of the process, see stage). Long running packages call checkpoint()
+    inside their loops, so a cancelled job stops within one tile or batch instead of at the end of the stage.
+    Stages may run concurrently on several threads, see guimg.graph.
+
+    Args:
+        on_progress (callable, optional): called with (fraction done, module_name) from the running threads
+    """
+
+    def __init__(self, on_progress=None):
+        self.on_progress = on_progress
+        # stats dict of every finished stage
+        self.stages = []
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        # { stage index: fraction done } of the started stages, and the number of stages of the run
+        self._progress = {}
+        self._count = 1
+        self._module_name = None
+        # stats dicts of the stages running right now
+        self._running = []
+
+    def cancel(self):
+        """ Asks the job to stop, it raises Cancelled at its next checkpoint """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self, done=None, total=None):
+        """ Raises Cancelled if the job has been cancelled, optionally reports done/total of the current stage """
+        # the stage this thread runs, threads a package starts itself only check for cancellation
+        index, module_name = getattr(_local, 'stage', (None, self._module_name))
+        if self._cancelled.is_set():
+            raise Cancelled(module_name)
+        if total and index is not None:
+            self._report(index, done / total, module_name)
+
+    def _report(self, index, fraction, module_name):
+        with self._lock:
+            self._progress[index] = fraction
+            done = sum(self._progress.values()) / self._count
+        if self.on_progress is not None:
+            self.on_progress(done, module_name)
+
+    def stats(self, module_name):
+        """ The stats dict of the last finished stage of module_name, None if there is none """
+        return next((stats for stats in reversed(self.stages) if stats["module"] == module_name), None)
+
+    @contextmanager
+    def stage(self, module_name, index, count):
+        """ Runs the stage index of count, measures it and makes the job current for checkpoint()
+
+        Yields the stats dict of the stage, once the stage is done it holds the module name, wall and CPU seconds,
+        the peak RSS in bytes and overlapped, and is appended to stages. CPU time and peak RSS are measured for the
+        whole process, so the threads the package starts (e.g. AHE tiles, torch) are included. overlapped is True
+        if other stages ran at some point during this one: the CPU time then includes theirs, and the peak RSS,
+        which can't be told apart per stage, is None (as it is where it can't be measured).
+        """
+        self._count = count
+        self._module_name = module_name
+        previous = getattr(_local, 'job', None), getattr(_local, 'stage', None)
+        _local.job, _local.stage = self, (index, module_name)
+        try:
+            self.check(0, 1)
+            stats = {"module": module_name}
+            with self._lock:
+                for other in self._running:
+                    other["overlapped"] = True
+                stats["overlapped"] = bool(self._running)
+                self._running.append(stats)
+            try:
+                # resetting the peak while another stage runs would lose the peak of that stage
+                measure_peak = not stats["overlapped"] and reset_peak_rss()
+                wall, cpu = time.perf_counter(), time.process_time()
+                yield stats
+            finally:
+                with self._lock:
+                    self._running = [other for other in self._running if other is not stats]
+        finally:
+            _local.job, _local.stage = previous
+        stats.update(wall=time.perf_counter() - wall, cpu=time.process_time() - cpu,
+                     peak_rss=peak_rss() if measure_peak and not stats["overlapped"] else None)
+        with self._lock:
+            self.stages.append(stats)
+        self._report(index, 1.0, module_name)
+
+
+def current_job():
+    """ The job whose stage runs on this thread, None outside of jobs """
+    return getattr(_local, 'job', None)
+
+
+def checkpoint(done=None, total=None):
+    """ Cancellation point for long running packages, a no-op outside of jobs
+
+    Args:
+        done (int, optional): units of work (tiles, batches) of the stage done so far
+        total (int, optional): units of work of the whole stage, done/total moves the progress bar
+    """
+    job = current_job()
+    if job is not None:
+        job.check(done, total)
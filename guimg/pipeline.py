@@ -0,0 +1,257 @@
+from contextlib import nullcontext
+
+import numpy as np
+
+from guimg.imaging import ImageData, detect_format
+from guimg.instrumentation import payload_bytes
+
+
+class UnexpectedResultError(TypeError):
+    """ Raised when the main function of a package returns neither a number nor an image """
+
+
+def is_numeric_result(result):
+    """ Numeric results come from quality measures and end up in the results table """
+    return isinstance(result, (int, float, np.floating))
+
+
+def is_image_result(result):
+    """ Image results come from preprocessing and can be handed to the next package """
+    try:
+        return detect_format(result) in ('bgr', 'tensor', 'tiled')
+    except TypeError:
+        return False
+
+
+def phase(tracer, name):
+    """ tracer.phase(name), or a no-op without a tracer, see guimg.instrumentation.Tracer """
+    return tracer.phase(name) if tracer is not None else nullcontext()
+
+
+def call_main(plugin, image, args=(), kwargs=None, tracer=None):
+    """ Runs a package on an ImageData
+
+    Packages which expose measure(image, shared, *args, **kwargs) are called through it, shared is the
+    dict of intermediates kept with the image, so e.g. several quality measures compute the grayscale
+    image and block statistics once. The others get their main function called.
+    Packages declaring TILED_INPUT = True get images which are memory-mapped (large .npy and TIFF inputs and
+    the tiled results of other packages) as a guimg.tiled.TiledImage, so they never have to be decoded whole.
+    With a tracer the conversion of the image and the call are timed as the decode and compute phases.
+    """
+    kwargs = kwargs or {}
+    fmt = plugin.input_format
+    if image.has('tiled') and getattr(plugin.module, 'TILED_INPUT', False):
+        fmt = 'tiled'
+    with phase(tracer, 'decode'):
+        data = image.get(fmt)
+    if tracer is not None:
+        tracer.note(bytes_in=payload_bytes(data))
+    measure = getattr(plugin.module, 'measure', None)
+    with phase(tracer, 'compute'):
+        if measure is not None:
+            return measure(data, image.shared, *args, **kwargs)
+        return plugin.main(data, *args, **kwargs)
+
+
+def stage_key(cache, registry, module_name, image, args=(), kwargs=None):
+    """ Cache key of running module_name on an ImageData, see guimg.cache.ResultCache """
+    input_key = image.key or image.fingerprint()
+    return cache.key(input_key, module_name, registry.source_hash(module_name), args, kwargs)
+
+
+def run_stage(registry, name, module_name, source, args=(), kwargs=None, handle=None, cache=None, job=None,
+              tracer=None, index=0, count=1):
+    """ Runs one stage of a pipeline: module_name on the ImageData source
+
+    The result is looked up in the cache first and stored to it when it had to be computed. The stage is
+    recorded as name in the job and the tracer, see run_pipeline.
+
+    Args:
+        handle (callable, optional): called with (result, cache key) once the stage has been recorded in the job,
+            inside the encode phase of the tracer
+        index (int, optional): position of the stage among the count stages of the job, for the progress
+
+    Returns:
+        : what handle returned, or the result without handle
+    """
+    key = result = None
+    with tracer.stage(name) if tracer is not None else nullcontext() as event:
+        with job.stage(name, index, count) if job is not None else nullcontext({}) as stats:
+            if cache is not None:
+                with phase(tracer, 'cache'):
+                    key = stage_key(cache, registry, module_name, source, args, kwargs)
+                    result = cache.get(key)
+            stats["cached"] = result is not None
+            if result is None:
+                # get the package, it is imported only on first use or when its __init__.py has changed
+                with phase(tracer, 'load'):
+                    plugin = registry.get(module_name)
+                # execute the main function
+                result = call_main(plugin, source, args, kwargs, tracer)
+                if cache is not None and (is_numeric_result(result) or is_image_result(result)):
+                    with phase(tracer, 'encode'):
+                        cache.put(key, result)
+        if event is not None:
+            event.update(cached=stats["cached"], bytes_out=payload_bytes(result))
+        if handle is None:
+            return result
+        with phase(tracer, 'encode'):
+            return handle(result, key)
+
+
+def run_pipeline(registry, image, module_names, function_args=None, pipeline=True, on_image=None, verbose=True,
+                 cache=None, on_result=None, job=None, tracer=None):
+    """ Applies the given algorithm packages to an image
+
+    Args:
+        registry (AlgorithmRegistry): registry the packages are loaded from
+        image : input image in any of guimg.imaging.IMAGE_FORMATS
+        module_names (list): names of the packages to run, they get sorted by processing order
+        function_args (dict, optional): { module_name: {"args": [...], "kwargs": {...}} } passed to main functions
+        pipeline (bool, optional): hand the image result of each package to the next one,
+            otherwise every package gets the original image. Defaults to True.
+        on_image (callable, optional): called with (module_name, ImageData) as soon as a package returns an image
+        verbose (bool, optional): print progress. Defaults to True.
+        cache (ResultCache, optional): stage results are looked up in and stored to it, see guimg.cache.
+            Defaults to None, every stage runs.
+        on_result (callable, optional): called with (module_name, float) as soon as a package returns a number
+        job (Job, optional): the stages run inside job.stage, so the run can be cancelled and every stage
+            is timed, see guimg.jobs. on_image and on_result are called after the stage has been recorded.
+        tracer (Tracer, optional): reports the phases, bytes and memory of every stage to it,
+            see guimg.instrumentation.
+
+    Raises:
+        UnexpectedResultError: if a main function returns neither a number nor an image
+        Cancelled: if the job is cancelled, at the next stage or checkpoint inside a package
+
+    Returns:
+        : dict with { module_name: float } structure holding the numeric results
+    """
+    function_args = function_args or {}
+    # dict for the numeric results(quality_measures)
+    results = {}
+
+    # the image is decoded once and handed from stage to stage in memory,
+    # every stage gets it in the form its package declares in INPUT_FORMAT
+    original = image if isinstance(image, ImageData) else ImageData(image)
+    current = original
+
+    module_names = registry.sort(module_names)
+    for index, module_name in enumerate(module_names):
+        if verbose:
+            print(f'performing {module_name}...')
+        # check if there should be any args/kwargs passed to this function
+        func_args = function_args.get(module_name, {})
+        args = func_args.get('args', [])
+        kwargs = func_args.get('kwargs', {})
+
+        def handle(result, key):
+            nonlocal current
+            # numeric results -> store in results dict
+            if is_numeric_result(result):
+                results[module_name] = float(result)
+                if on_result is not None:
+                    on_result(module_name, results[module_name])
+            elif is_image_result(result):
+                result_image = ImageData(result, key)
+                if pipeline:
+                    # the next function gets the result of this function as input
+                    current = result_image
+                if on_image is not None:
+                    on_image(module_name, result_image)
+            else:
+                # unexpected type was returned from the main function of current module
+                raise UnexpectedResultError(f"Unexpected result type {type(result)} from module {module_name}")
+
+        run_stage(registry, module_name, module_name, current if pipeline else original, args, kwargs, handle,
+                  cache, job, tracer, index, len(module_names))
+        if verbose:
+            print(f'finished {module_name}')
+
+    return results
+
+
+def run_pipeline_batch(registry, images, module_names, function_args=None, pipeline=True, on_image=None, cache=None):
+    """ run_pipeline for a list of images, stage by stage
+
+    Packages which expose main_batch(images, *args, **kwargs) get all images of a stage in one call,
+    e.g. to run them through a network as one batch. The other packages are called once per image.
+    An image whose stage fails is not processed further, the other images continue.
+
+    Args:
+        registry (AlgorithmRegistry): registry the packages are loaded from
+        images (list): input images in any of guimg.imaging.IMAGE_FORMATS
+        module_names (list): names of the packages to run, they get sorted by processing order
+        function_args (dict, optional): { module_name: {"args": [...], "kwargs": {...}} } passed to main functions
+        pipeline (bool, optional): hand the image result of each package to the next one. Defaults to True.
+        on_image (callable, optional): called with (image index, module_name, ImageData) for every image result
+        cache (ResultCache, optional): stage results are looked up in and stored to it, see guimg.cache.
+
+    Returns:
+        : list with the numeric results dict, or the raised exception, of every image
+    """
+    function_args = function_args or {}
+    originals = [ImageData(image) for image in images]
+    current = list(originals)
+    outcomes = [{} for _ in images]
+
+    for module_name in registry.sort(module_names):
+        func_args = function_args.get(module_name, {})
+        args = func_args.get('args', [])
+        kwargs = func_args.get('kwargs', {})
+
+        pending = [index for index, outcome in enumerate(outcomes) if isinstance(outcome, dict)]
+        sources = {index: (current if pipeline else originals)[index] for index in pending}
+        keys = {}
+        stage_results = {}
+        if cache is not None:
+            for index in pending:
+                try:
+                    keys[index] = stage_key(cache, registry, module_name, sources[index], args, kwargs)
+                except OSError as e:
+                    outcomes[index] = e
+                    continue
+                cached = cache.get(keys[index])
+                if cached is not None:
+                    stage_results[index] = cached
+        missing = [index for index in pending if index not in stage_results and isinstance(outcomes[index], dict)]
+
+        plugin = registry.get(module_name) if missing else None
+        main_batch = getattr(plugin.module, 'main_batch', None) if plugin else None
+        if main_batch is not None and len(missing) > 1:
+            try:
+                batch = [sources[index].get(plugin.input_format) for index in missing]
+                computed = dict(zip(missing, main_batch(batch, *args, **kwargs)))
+            except Exception:
+                # find out which image broke the batch by running them one by one
+                computed = {}
+        else:
+            computed = {}
+
+        for index in pending:
+            if not isinstance(outcomes[index], dict):
+                continue
+            try:
+                if index in stage_results:
+                    result = stage_results[index]
+                else:
+                    if index in computed:
+                        result = computed[index]
+                    else:
+                        result = call_main(plugin, sources[index], args, kwargs)
+                    if cache is not None and (is_numeric_result(result) or is_image_result(result)):
+                        cache.put(keys[index], result)
+                if is_numeric_result(result):
+                    outcomes[index][module_name] = float(result)
+                elif is_image_result(result):
+                    result_image = ImageData(result, keys.get(index))
+                    if pipeline:
+                        current[index] = result_image
+                    if on_image is not None:
+                        on_image(index, module_name, result_image)
+                else:
+                    raise UnexpectedResultError(f"Unexpected result type {type(result)} from module {module_name}")
+            except Exception as e:
+                outcomes[index] = e
+
+    return outcomes
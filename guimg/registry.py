@@ -0,0 +1,231 @@
+import ast
+import hashlib
+import importlib.util
+import os
+import sys
+import threading
+
+# order in which the categories of the bundled algorithms run
+DEFAULT_PROCESSING_ORDER = ('preprocessing', 'quality_measures')
+
+
+# the guimg modules are next to this one
+GUIMG_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# guimg modules every result depends on, whatever the package imports: imaging converts the input of every package
+RESULT_MODULES = ('imaging',)
+
+
+def _file_digest(path, file_digests):
+    # sources are re-read only when they change
+    mtime = os.stat(path).st_mtime_ns
+    cached = file_digests.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = file_digests[path] = (mtime, hashlib.blake2b(f.read(), digest_size=16).digest())
+    return cached[1]
+
+
+def _guimg_imports(path, import_cache):
+    """ Names of the guimg modules a python file imports, e.g. {'imaging', 'jobs'} """
+    mtime = os.stat(path).st_mtime_ns
+    cached = import_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            try:
+                tree = ast.parse(f.read(), path)
+            except SyntaxError:
+                # the package fails to import then, there are no results to keep apart
+                tree = ast.Module(body=[], type_ignores=[])
+        modules = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                modules.add(node.module)
+                # from guimg import imaging
+                modules.update(f'{node.module}.{alias.name}' for alias in node.names)
+        names = {module.split('.')[1] for module in modules if module.startswith('guimg.')}
+        cached = import_cache[path] = (mtime, names)
+    return cached[1]
+
+
+def _tree_digest(directory, hasher, file_digests):
+    """ Feeds the files below directory into hasher, python sources by content, other files by size and mtime
+
+    Returns:
+        : paths of the python sources
+    """
+    sources = []
+    for parent, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('_', '.')))
+        for file_name in sorted(files):
+            path = os.path.join(parent, file_name)
+            stat = os.stat(path)
+            hasher.update(os.path.relpath(path, directory).encode())
+            if not file_name.endswith('.py'):
+                hasher.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+                continue
+            hasher.update(_file_digest(path, file_digests))
+            sources.append(path)
+    return sources
+
+
+class Plugin:
+    """ An algorithm package found in the algorithms directory
+
+    The package is imported on first use, the module and its main function are cached
+    and the package is re-imported only when its __init__.py changes on disk.
+    """
+
+    def __init__(self, name, category, directory, module_name):
+        self.name = name
+        self.category = category
+        self.directory = directory
+        # full dotted name, so imports inside the package resolve to this module instead of importing it twice
+        self.module_name = module_name
+        self.init_path = os.path.join(directory, '__init__.py')
+        self.module = None
+        self.main = None
+        self._mtime = None
+
+    @property
+    def input_format(self):
+        """ Form in which main expects its input image, packages which don't declare one get a path """
+        return getattr(self.module, 'INPUT_FORMAT', 'path')
+
+    def load(self):
+        mtime = os.path.getmtime(self.init_path)
+        if self.module is None or mtime != self._mtime:
+            spec = importlib.util.spec_from_file_location(self.module_name, self.init_path,
+                                                          submodule_search_locations=[self.directory])
+            module = importlib.util.module_from_spec(spec)
+            # register the package the way a regular import would, so `import algorithms.<category>.<name>.x`
+            # inside the package finds it
+            parent_name, _, child_name = self.module_name.rpartition('.')
+            setattr(importlib.import_module(parent_name), child_name, module)
+            sys.modules[self.module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                sys.modules.pop(self.module_name, None)
+                raise
+            self.module = module
+            self.main = module.main
+            self._mtime = mtime
+        return self.module
+
+
+class AlgorithmRegistry:
+    """ Discovers the algorithm packages in algorithms_directory and loads them on demand
+
+    Every direct subdirectory of algorithms_directory is a category, every python package inside a category
+    is an algorithm. Directories starting with '_' or '.' and categories without packages are skipped.
+
+    Args:
+        algorithms_directory (str): path to the algorithms directory
+        processing_order (list, optional): order in which the categories should run,
+            categories not listed here run after the listed ones in alphabetical order.
+            Defaults to DEFAULT_PROCESSING_ORDER.
+    """
+
+    def __init__(self, algorithms_directory, processing_order=DEFAULT_PROCESSING_ORDER):
+        self.algorithms_directory = algorithms_directory
+        self.processing_order = list(processing_order)
+        self._plugins = None
+        self._lock = threading.RLock()
+        # { path: (mtime, digest) } of the python sources hashed by source_hash
+        self._file_digests = {}
+        # { path: (mtime, guimg module names) } of the python sources hashed by source_hash
+        self._imports = {}
+
+        # add the parent of the algorithms directory to sys path, so the imports in packages work
+        parent_dir = os.path.dirname(os.path.abspath(algorithms_directory))
+        if parent_dir not in sys.path:
+            sys.path.insert(0, parent_dir)
+
+    @property
+    def plugins(self):
+        """ dict with { package_name: Plugin } structure, the filesystem is scanned only once """
+        with self._lock:
+            if self._plugins is None:
+                self._plugins = self._discover()
+            return self._plugins
+
+    def rediscover(self):
+        """ Forget the scanned packages, the next access scans the algorithms directory again """
+        with self._lock:
+            self._plugins = None
+
+    def _discover(self):
+        plugins = {}
+        root_package = os.path.basename(os.path.normpath(self.algorithms_directory))
+        for category in sorted(os.listdir(self.algorithms_directory), key=self.category_rank):
+            category_dir = os.path.join(self.algorithms_directory, category)
+            if category.startswith(('_', '.')) or not os.path.isdir(category_dir):
+                continue
+            for name in sorted(os.listdir(category_dir)):
+                package_dir = os.path.join(category_dir, name)
+                if name.startswith(('_', '.')) or not os.path.isfile(os.path.join(package_dir, '__init__.py')):
+                    continue
+                plugins[name] = Plugin(name, category, package_dir, f'{root_package}.{category}.{name}')
+        return plugins
+
+    def category_rank(self, category):
+        if category in self.processing_order:
+            return self.processing_order.index(category), ''
+        return len(self.processing_order), category
+
+    def categories(self):
+        """ Returns { category: [package_name, ...] } in processing order """
+        categories = {}
+        for plugin in self.plugins.values():
+            categories.setdefault(plugin.category, []).append(plugin.name)
+        return categories
+
+    def sort(self, names):
+        """ Sorts package names by the processing order of their categories """
+        return sorted(names, key=lambda name: self.category_rank(self.plugins[name].category))
+
+    def get(self, name):
+        """ Returns the loaded Plugin of the package, importing it if needed """
+        plugin = self.plugins[name]
+        with self._lock:
+            plugin.load()
+        return plugin
+
+    def source_hash(self, name):
+        """ Hash of the code and data the results of a package depend on
+
+        Covers the package directory, the directories of shared code next to the categories (e.g. algorithms/common)
+        and the guimg modules they import directly or through other guimg modules (plus RESULT_MODULES), so editing
+        any of them invalidates cached results of the package, see guimg.cache.
+
+        Returns:
+            : hex digest
+        """
+        plugin = self.plugins[name]
+        categories = {p.category for p in self.plugins.values()}
+        hasher = hashlib.blake2b(digest_size=16)
+        with self._lock:
+            sources = _tree_digest(plugin.directory, hasher, self._file_digests)
+            for entry in sorted(os.listdir(self.algorithms_directory)):
+                path = os.path.join(self.algorithms_directory, entry)
+                if entry in categories or entry.startswith(('_', '.')) or not os.path.isdir(path):
+                    continue
+                hasher.update(entry.encode())
+                sources += _tree_digest(path, hasher, self._file_digests)
+
+            modules = set(RESULT_MODULES)
+            pending = set(RESULT_MODULES).union(*(_guimg_imports(source, self._imports) for source in sources))
+            while pending:
+                name = pending.pop()
+                modules.add(name)
+                path = os.path.join(GUIMG_DIRECTORY, f'{name}.py')
+                if os.path.exists(path):
+                    pending |= _guimg_imports(path, self._imports) - modules
+            for name in sorted(modules):
+                path = os.path.join(GUIMG_DIRECTORY, f'{name}.py')
+                if os.path.exists(path):
+                    hasher.update(f'guimg.{name}'.encode())
+                    hasher.update(_file_digest(path, self._file_digests))
+        return hasher.hexdigest()
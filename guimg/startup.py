@@ -0,0 +1,116 @@
+import builtins
+import json
+import os
+import sys
+import threading
+import time
+
+# libraries the packages need, imported up front so the first run doesn't pay for them
+HEAVY_MODULES = ('numpy', 'cv2', 'PIL.Image', 'torch', 'guimg.pipeline', 'guimg.graph', 'guimg.cache', 'guimg.jobs')
+
+
+class ImportTimer:
+    """ Records how long every module import takes, like python -X importtime
+
+    While installed, imports of modules which aren't loaded yet are timed, per module the cumulative time
+    (including the modules it imports) and the self time (excluding them) are kept.
+    """
+
+    def __init__(self):
+        # { module name: (self seconds, cumulative seconds) }
+        self.timings = {}
+        self._original = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+        return self
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original or builtins.__import__
+        if level or name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+        # time spent in nested imports, subtracted from the self time of their parent
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        began = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - began
+            nested = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            with self._lock:
+                self.timings.setdefault(name, (cumulative - nested, cumulative))
+
+    def slowest(self, count=20):
+        """ The count imports with the longest cumulative time as [{"module", "self", "cumulative"}, ...] """
+        with self._lock:
+            ranked = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        return [{"module": name, "self": round(own, 4), "cumulative": round(cumulative, 4)}
+                for name, (own, cumulative) in ranked]
+
+
+class StartupTelemetry:
+    """ Seconds from process start to the startup milestones, appended as one JSON line per session
+
+    Args:
+        path (str): JSON lines file the sessions are appended to
+        started (float): time.perf_counter() when the application started
+    """
+
+    def __init__(self, path, started):
+        self.path = path
+        self.started = started
+        # { milestone: seconds since start }, only the first time a milestone is reached counts
+        self.milestones = {}
+        # { package name: seconds to import and warm it up }
+        self.packages = {}
+
+    def mark(self, milestone):
+        self.milestones.setdefault(milestone, round(time.perf_counter() - self.started, 4))
+
+    def write(self, import_timer=None):
+        record = {"time": time.time(), "python": sys.version.split()[0], "milestones": self.milestones,
+                  "packages": self.packages}
+        if import_timer is not None:
+            record["imports"] = import_timer.slowest()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def prewarm(registry, telemetry=None):
+    """ Imports the heavy libraries and all packages and runs their warmup() hooks
+
+    Meant for a background thread while the user picks an image. A package that fails to import
+    is skipped, it will report its error when it is run.
+    """
+    from guimg.executor import warm_up
+
+    for module_name in HEAVY_MODULES:
+        try:
+            # through builtins.__import__, so an installed ImportTimer sees it
+            __import__(module_name)
+        except ImportError:
+            pass
+    for name in registry.plugins:
+        began = time.perf_counter()
+        try:
+            warm_up(registry, [name])
+        except Exception as e:
+            print(f'prewarming {name} failed: {type(e).__name__}: {e}')
+            continue
+        if telemetry is not None:
+            telemetry.packages[name] = round(time.perf_counter() - began, 4)
@@ -0,0 +1,288 @@
+import csv
+import glob
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from guimg.executor import warm_up
+from guimg.graph import MEASURE_CATEGORIES
+from guimg.jobs import Cancelled
+from guimg.pipeline import run_pipeline_batch
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm')
+SEQUENCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+# frames per second written for image sequences, which don't store one
+DEFAULT_SEQUENCE_FPS = 25.0
+# frames that may wait between two stages, bounds the memory no matter how long the clip is
+DEFAULT_QUEUE_SIZE = 8
+
+# put into a queue after the last frame
+_END = object()
+
+
+def is_video_source(path):
+    """ Video files, numbered sequences given as a printf pattern (frames/%04d.png), globs and directories of frames """
+    path = os.fspath(path)
+    return (path.lower().endswith(VIDEO_EXTENSIONS) or '%' in path or glob.has_magic(path)
+            or os.path.isdir(path))
+
+
+class FrameSource:
+    """ Reads the frames of a video file or an image sequence one at a time, as BGR uint8 arrays
+
+    Args:
+        path (str): video file, printf pattern of a numbered sequence (read by OpenCV), glob or directory of frames
+        fps (float, optional): frame rate of image sequences. Defaults to DEFAULT_SEQUENCE_FPS.
+        sequence (bool, optional): treat directories and globs as image sequences, False opens path as a video file
+            even if its name contains glob characters, e.g. an uploaded clip[1].mp4. Defaults to True.
+    """
+
+    def __init__(self, path, fps=DEFAULT_SEQUENCE_FPS, sequence=True):
+        self.path = os.fspath(path)
+        self.fps = fps
+        self._files = None
+        if sequence and (os.path.isdir(self.path) or glob.has_magic(self.path)):
+            pattern = os.path.join(self.path, '*') if os.path.isdir(self.path) else self.path
+            self._files = sorted(path for path in glob.glob(pattern) if path.lower().endswith(SEQUENCE_EXTENSIONS))
+            self.frame_count = len(self._files)
+        else:
+            capture = cv2.VideoCapture(self.path)
+            if not capture.isOpened():
+                raise OSError(f"Can't open the video {self.path}")
+            self.frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+            # numbered sequences read by OpenCV report no frame rate
+            self.fps = capture.get(cv2.CAP_PROP_FPS) or fps
+            capture.release()
+
+    def __iter__(self):
+        if self._files is not None:
+            for path in self._files:
+                frame = cv2.imread(path, 1)
+                if frame is None:
+                    raise OSError(f"Can't read the frame {path}")
+                yield frame
+            return
+        capture = cv2.VideoCapture(self.path)
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield frame
+        finally:
+            capture.release()
+
+
+class _Stage:
+    """ A thread taking items from one bounded queue and putting its results into the next one
+
+    Items are tuples starting with the list of frames of a batch. Keeps the number of frames the stage handled
+    and the seconds it was busy, waiting for a queue doesn't count.
+    """
+
+    def __init__(self, name, work, source, sink, stop):
+        self.name = name
+        self.work = work
+        self.source = source
+        self.sink = sink
+        self.stop = stop
+        self.frames = 0
+        self.busy = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f'stream-{name}', daemon=True)
+
+    def _get(self):
+        while not self.stop.is_set():
+            try:
+                return self.source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.sink.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _items(self):
+        while True:
+            item = self._get()
+            if item is _END:
+                return
+            yield item
+
+    def _produced(self, item, began):
+        self.frames += len(item[0])
+        self.busy += time.perf_counter() - began
+        if self.sink is not None:
+            self._put(item)
+
+    def _run(self):
+        try:
+            if self.source is None:
+                # the first stage, work is an iterable producing the items
+                iterator = iter(self.work)
+                while not self.stop.is_set():
+                    began = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    self._produced(item, began)
+            else:
+                for item in self._items():
+                    began = time.perf_counter()
+                    self._produced(self.work(item), began)
+        except BaseException as e:
+            self.error = e
+            self.stop.set()
+        finally:
+            if self.sink is not None:
+                self._put(_END)
+
+    def stats(self):
+        return {"frames": self.frames, "seconds": round(self.busy, 4),
+                "fps": round(self.frames / self.busy, 2) if self.busy else None}
+
+
+def _batches(frames, batch_size):
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _run_stage_batch(registry, frames, module_names, function_args, pipeline):
+    """ Runs the packages on a batch of frames, returns the last image result of every frame and its numeric results """
+    images = list(frames)
+
+    def on_image(index, module_name, image):
+        images[index] = image.get('bgr')
+
+    outcomes = run_pipeline_batch(registry, frames, module_names, function_args, pipeline=pipeline, on_image=on_image)
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            raise outcome
+    return images, outcomes
+
+
+def process_stream(registry, source, module_names, function_args=None, pipeline=True, output_video=None,
+                   metrics_csv=None, batch_size=1, queue_size=DEFAULT_QUEUE_SIZE, on_frame=None, job=None):
+    """ Runs the packages over the frames of a video or image sequence
+
+    Decoding, enhancing (the preprocessing packages), measuring (the quality measures) and encoding run on their own
+    threads at the same time, connected by queues holding at most queue_size batches, so a long clip takes as much
+    memory as a short one. With pipeline the measures get the enhanced frame, otherwise the decoded one.
+
+    Args:
+        registry (AlgorithmRegistry): registry the packages are loaded from
+        source (str or FrameSource): the video or image sequence, see FrameSource
+        module_names (list): names of the packages to run
+        function_args (dict, optional): { module_name: {"args": [...], "kwargs": {...}} } passed to main functions
+        pipeline (bool, optional): hand the image result of each package to the next one. Defaults to True.
+        output_video (str, optional): the enhanced frames are written to this video file, with the source frame rate
+        metrics_csv (str, optional): one row per frame with the numeric results of the quality measures
+        batch_size (int, optional): frames run through the packages together, packages exposing main_batch
+            (e.g. Zero_DCE) get all of them in one call. Defaults to 1.
+        queue_size (int, optional): batches that may wait between two stages. Defaults to DEFAULT_QUEUE_SIZE.
+        on_frame (callable, optional): called with (frame index, { module_name: float }) once a frame is written
+        job (Job, optional): the run stops once the job is cancelled
+
+    Raises:
+        Cancelled: if the job is cancelled
+        Exception: the first exception raised by a stage, the other stages stop then too
+
+    Returns:
+        : dict with the frame count, the overall frames per second and { "frames", "seconds", "fps" } of every stage
+    """
+    function_args = function_args or {}
+    source = source if isinstance(source, FrameSource) else FrameSource(source)
+    module_names = registry.sort(module_names)
+    enhancers = [name for name in module_names if registry.plugins[name].category not in MEASURE_CATEGORIES]
+    measures = [name for name in module_names if name not in enhancers]
+    warm_up(registry, module_names)
+
+    stop = threading.Event()
+    decoded, enhanced, measured = (queue.Queue(maxsize=queue_size) for _ in range(3))
+    writer = None
+    metrics_file = None
+    csv_writer = None
+    written = 0
+
+    def enhance(item):
+        batch, = item
+        if not enhancers:
+            return batch, batch, [{} for _ in batch]
+        images, outcomes = _run_stage_batch(registry, batch, enhancers, function_args, pipeline)
+        return images, images if pipeline else batch, outcomes
+
+    def measure(item):
+        images, inputs, outcomes = item
+        if measures:
+            _, measured_outcomes = _run_stage_batch(registry, inputs, measures, function_args, False)
+            for outcome, measured_outcome in zip(outcomes, measured_outcomes):
+                outcome.update(measured_outcome)
+        return images, outcomes
+
+    def encode(item):
+        nonlocal writer, metrics_file, csv_writer, written
+        images, outcomes = item
+        for image, outcome in zip(images, outcomes):
+            if output_video is not None:
+                if writer is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(output_video)), exist_ok=True)
+                    height, width = image.shape[:2]
+                    writer = cv2.VideoWriter(output_video, cv2.VideoWriter_fourcc(*'mp4v'), source.fps,
+                                             (width, height))
+                writer.write(image)
+            if metrics_csv is not None and measures:
+                if csv_writer is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(metrics_csv)), exist_ok=True)
+                    metrics_file = open(metrics_csv, "w", newline="")
+                    csv_writer = csv.writer(metrics_file)
+                    csv_writer.writerow(["frame", "time", *measures])
+                csv_writer.writerow([written, round(written / source.fps, 4), *(outcome.get(name) for name in measures)])
+            if on_frame is not None:
+                on_frame(written, outcome)
+            written += 1
+        return images,
+
+    def frames():
+        for batch in _batches(source, batch_size):
+            if job is not None and job.cancelled:
+                raise Cancelled('decode')
+            yield batch,
+
+    stages = [_Stage('decode', frames(), None, decoded, stop),
+              _Stage('enhance', enhance, decoded, enhanced, stop),
+              _Stage('measure', measure, enhanced, measured, stop),
+              _Stage('encode', encode, measured, None, stop)]
+    began = time.perf_counter()
+    try:
+        for stage in stages:
+            stage.thread.start()
+        for stage in stages:
+            stage.thread.join()
+    finally:
+        stop.set()
+        if writer is not None:
+            writer.release()
+        if metrics_file is not None:
+            metrics_file.close()
+    errors = [stage.error for stage in stages if stage.error is not None]
+    if errors:
+        raise errors[0]
+
+    seconds = time.perf_counter() - began
+    return {"frames": written, "seconds": round(seconds, 4), "fps": round(written / seconds, 2) if seconds else None,
+            "stages": {stage.name: stage.stats() for stage in stages}}
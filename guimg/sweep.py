@@ -0,0 +1,127 @@
+import csv
+import itertools
+import math
+
+from guimg.graph import INPUT, Node, linear_graph
+
+# a swept argument in function_args lists its values, e.g. {"kwargs": {"block_size": {"sweep": [7, 15, 31]}}},
+# or gives them as a range, {"kwargs": {"rx": {"range": [64, 256, 32]}}} is 64, 96, ..., 256 (stop included)
+SWEEP = 'sweep'
+RANGE = 'range'
+
+
+def swept_values(value):
+    """ The values of a swept argument, None if the argument isn't swept """
+    if not isinstance(value, dict) or len(value) != 1:
+        return None
+    if SWEEP in value:
+        return list(value[SWEEP])
+    if RANGE in value:
+        start, stop, *step = value[RANGE]
+        step = step[0] if step else 1
+        if step <= 0:
+            raise ValueError(f"The step of a range must be positive, not {step}")
+        count = math.floor((stop - start) / step + 1e-9) + 1
+        # rounding keeps float steps from producing values like 0.30000000000000004
+        return [start + i * step if isinstance(start + step, int) else round(start + i * step, 10)
+                for i in range(max(count, 0))]
+    return None
+
+
+def swept_arguments(function_args):
+    """ [(module_name, "args" or "kwargs", index or name, values), ...] of the swept arguments in function_args """
+    swept = []
+    for module_name, func_args in function_args.items():
+        for index, value in enumerate(func_args.get('args', [])):
+            values = swept_values(value)
+            if values is not None:
+                swept.append((module_name, 'args', index, values))
+        for name, value in func_args.get('kwargs', {}).items():
+            values = swept_values(value)
+            if values is not None:
+                swept.append((module_name, 'kwargs', name, values))
+    return swept
+
+
+def is_sweep(function_args):
+    return bool(swept_arguments(function_args or {}))
+
+
+class Sweep:
+    """ A parameter sweep over the packages of a pipeline
+
+    Every combination of the swept values in function_args is a point. The points are merged into one graph
+    (see guimg.graph) in which a stage that is the same for several points, because neither its args nor
+    those of the stages before it change between them, is a single node. Running the graph decodes the input once,
+    computes every distinct stage once and runs the independent ones in parallel.
+
+    Nodes are named after their package and the swept values they depend on, e.g. "BIE (rx=64, block_size=7)".
+
+    Args:
+        registry (AlgorithmRegistry): registry of the packages
+        module_names (list): names of the packages to run
+        function_args (dict): { module_name: {"args": [...], "kwargs": {...}} } with swept values, see SWEEP and RANGE
+        pipeline (bool, optional): hand the image result of each package to the next one. Defaults to True.
+    """
+
+    def __init__(self, registry, module_names, function_args, pipeline=True):
+        self.module_names = registry.sort(module_names)
+        swept = sorted((argument for argument in swept_arguments(function_args) if argument[0] in self.module_names),
+                       key=lambda argument: self.module_names.index(argument[0]))
+        # the argument name alone labels a value, unless two packages sweep an argument of the same name
+        names = [str(name) if isinstance(name, str) else f'{module_name}[{name}]'
+                 for module_name, _, name, _ in swept]
+        self.labels = [name if names.count(name) == 1 else f'{module_name}.{name}'
+                       for name, (module_name, _, _, _) in zip(names, swept)]
+        # [{ label: value }, ...] of every point
+        self.points = [dict(zip(self.labels, combination))
+                       for combination in itertools.product(*(values for _, _, _, values in swept))]
+        self.nodes = {}
+        # [{ module_name: node name }, ...] of every point
+        self.point_nodes = []
+
+        for point in self.points:
+            concrete = {name: {"args": list(func_args.get('args', [])), "kwargs": dict(func_args.get('kwargs', {}))}
+                        for name, func_args in function_args.items()}
+            for label, (module_name, kind, name, _) in zip(self.labels, swept):
+                concrete[module_name][kind][name] = point[label]
+            names = {INPUT: INPUT}
+            # labels of the swept values the output of every node depends on
+            depends = {INPUT: []}
+            for node in linear_graph(registry, self.module_names, concrete, pipeline).values():
+                own = [f'{label}={point[label]}' for label, argument in zip(self.labels, swept)
+                       if argument[0] == node.module_name]
+                depends[node.name] = depends[node.input] + own
+                name = f"{node.module_name} ({', '.join(depends[node.name])})" if depends[node.name] else node.name
+                names[node.name] = name
+                self.nodes.setdefault(name, Node(name, node.module_name, names[node.input], node.args, node.kwargs))
+            self.point_nodes.append({module_name: names[module_name] for module_name in self.module_names})
+
+    def spec(self):
+        """ The graph as a spec for guimg.graph.parse_graph, e.g. for the command line """
+        return {"nodes": {name: {"module": node.module_name, "input": node.input, "args": node.args,
+                                 "kwargs": node.kwargs}
+                          for name, node in self.nodes.items()}}
+
+    def table(self, results):
+        """ One row per point with its swept values and the numeric results of its packages
+
+        Args:
+            results (dict): { node_name: float } as returned by guimg.graph.run_graph
+
+        Returns:
+            : (columns, rows), rows is a list of dicts keyed by the columns
+        """
+        measured = [module_name for module_name in self.module_names
+                    if any(nodes[module_name] in results for nodes in self.point_nodes)]
+        rows = [dict(point, **{module_name: results.get(nodes[module_name]) for module_name in measured})
+                for point, nodes in zip(self.points, self.point_nodes)]
+        return self.labels + measured, rows
+
+    def write_csv(self, path, results):
+        columns, rows = self.table(results)
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
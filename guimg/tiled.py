@@ -0,0 +1,175 @@
+import mmap
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+# files opened as memory-mapped TiledImages instead of being decoded, raw files need their shape, see TiledImage.raw
+TILED_EXTENSIONS = ('.npy', '.tif', '.tiff')
+# most bytes of a band read at once, bounds the memory of processing a tiled image
+DEFAULT_BAND_BYTES = 64 * 2 ** 20
+
+
+class TiledImage:
+    """ A large uint8 image in a memory-mapped file, read and written band by band or tile by tile
+
+    Packages which declare TILED_INPUT = True get large images in this form (see guimg.pipeline.call_main) and
+    process them in bounded pieces instead of decoding them as a whole. read returns BGR copies of a region and
+    drops the pages it touched from the process, so the resident memory stays at about one band no matter how
+    large the file is.
+
+    Args:
+        array : HxWx3 (BGR, or RGB with rgb) or HxW uint8 array, usually a view of mapping
+        mapping (mmap.mmap, optional): the memory map the array views, its pages are released after every read/write
+        offset (int, optional): offset of the pixels in mapping
+        rgb (bool, optional): the channels are stored in RGB order, as in TIFF files. Defaults to False.
+    """
+
+    def __init__(self, array, mapping=None, offset=0, rgb=False):
+        self.array = array
+        self.rgb = rgb
+        self._mapping = mapping
+        self._offset = offset
+
+    @classmethod
+    def map(cls, path, shape, dtype=np.uint8, offset=0, rgb=False, writable=False):
+        """ Maps the pixels stored at offset in path, C order """
+        with open(path, 'r+b' if writable else 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        count = int(np.prod(shape))
+        array = np.frombuffer(mapping, dtype=dtype, count=count, offset=offset).reshape(shape)
+        return cls(array, mapping, offset, rgb)
+
+    @classmethod
+    def raw(cls, path, shape, offset=0, rgb=False):
+        """ Raw interleaved uint8 pixels, e.g. TiledImage.raw('mosaic.raw', (40000, 60000, 3)) """
+        return cls.map(path, shape, np.uint8, offset, rgb)
+
+    @classmethod
+    def open(cls, path):
+        """ Opens a .npy file or an uncompressed TIFF without reading its pixels
+
+        Raises:
+            ImportError: for TIFF files if tifffile isn't installed
+            ValueError: if the file can't be memory-mapped (compressed TIFF, not uint8, Fortran order)
+        """
+        path = os.fspath(path)
+        if path.lower().endswith('.npy'):
+            with open(path, 'rb') as f:
+                version = np.lib.format.read_magic(f)
+                read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                               else np.lib.format.read_array_header_2_0)
+                shape, fortran_order, dtype = read_header(f)
+                offset = f.tell()
+            if fortran_order or dtype != np.uint8:
+                raise ValueError(f"{path} must hold a C order uint8 array to be tiled, not {dtype}")
+            return cls.map(path, shape, dtype, offset)
+        try:
+            import tifffile
+        except ImportError:
+            raise ImportError("Memory-mapping TIFF files needs tifffile, pip install tifffile") from None
+        # tifffile finds where the pixels are, they are then mapped like a raw file
+        mapped = tifffile.memmap(path, mode='r')
+        shape, dtype, offset = mapped.shape, mapped.dtype, mapped.offset
+        del mapped
+        if dtype != np.uint8:
+            raise ValueError(f"{path} must hold uint8 pixels to be tiled, not {dtype}")
+        return cls.map(path, shape, dtype, offset, rgb=len(shape) == 3)
+
+    @classmethod
+    def empty(cls, shape, directory=None):
+        """ A new image backed by an anonymous temporary file, which is removed once the image is closed """
+        with tempfile.TemporaryFile(dir=directory) as f:
+            f.truncate(int(np.prod(shape)))
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+        return cls(np.frombuffer(mapping, dtype=np.uint8).reshape(shape), mapping)
+
+    @classmethod
+    def from_array(cls, array):
+        """ Wraps an image that is already in memory, so it can be handed to code expecting a TiledImage """
+        return cls(np.asarray(array))
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    def bands(self, multiple=1, max_bytes=DEFAULT_BAND_BYTES):
+        """ Yields (top, bottom) row ranges of at most max_bytes, their heights are multiples of multiple """
+        height = self.shape[0]
+        row_bytes = max(self.array[:1].nbytes, 1)
+        rows = max(max_bytes // row_bytes // multiple, 1) * multiple
+        for top in range(0, height, rows):
+            yield top, min(top + rows, height)
+
+    def read(self, top, bottom, left=0, right=None):
+        """ BGR copy of the region, single channel images are expanded to three channels """
+        region = np.array(self.array[top:bottom, left:right])
+        self.release(top, bottom)
+        if region.ndim == 2:
+            return cv2.cvtColor(region, cv2.COLOR_GRAY2BGR)
+        if self.rgb:
+            return np.ascontiguousarray(region[..., ::-1])
+        return region
+
+    def write(self, top, left, region):
+        """ Stores a BGR region with its top left corner at (top, left) """
+        self.array[top:top + region.shape[0], left:left + region.shape[1]] = region[..., ::-1] if self.rgb else region
+        self.release(top, top + region.shape[0])
+
+    def release(self, top, bottom):
+        """ Drops the pages of rows top to bottom from the process, they stay in the page cache and the file """
+        if self._mapping is None or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        row_bytes = self.array[:1].nbytes
+        start = self._offset + top * row_bytes
+        aligned = start - start % mmap.PAGESIZE
+        length = start - aligned + (bottom - top) * row_bytes
+        if length > 0:
+            self._mapping.madvise(mmap.MADV_DONTNEED, aligned, min(length, len(self._mapping) - aligned))
+
+    def to_array(self):
+        """ The whole image as an in-memory BGR array """
+        return self.read(0, self.shape[0])
+
+    def thumbnail(self, max_side):
+        """ A BGR preview whose longer side is about max_side, read from every n-th row and column only """
+        height, width = self.shape[:2]
+        step = max(max(height, width) // max_side, 1)
+        rows = []
+        for top, bottom in self.bands(multiple=step):
+            rows.append(np.array(self.array[top:bottom:step, ::step]))
+            self.release(top, bottom)
+        preview = TiledImage(np.concatenate(rows), rgb=self.rgb)
+        return preview.to_array()
+
+    def save(self, file):
+        """ Writes the image as .npy to a path or binary file, band by band """
+        header = {'descr': np.lib.format.dtype_to_descr(self.array.dtype), 'fortran_order': False,
+                  'shape': self.shape}
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'wb') as f:
+                return self.save(f)
+        np.lib.format.write_array_header_2_0(file, header)
+        for top, bottom in self.bands():
+            region = self.read(top, bottom)
+            file.write(region if self.array.ndim == 3 else region[..., 0].copy())
+        return file
+
+    def close(self):
+        if self._mapping is not None:
+            self.array = None
+            self._mapping.close()
+            self._mapping = None
+
+
+def open_tiled(path):
+    """ TiledImage of a .npy or TIFF file, None if the file can't be memory-mapped and has to be decoded """
+    try:
+        return TiledImage.open(path)
+    except (ImportError, ValueError, OSError):
+        return None
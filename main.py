@@ -1,38 +1,60 @@
-import importlib.util
 import json
 import os
-import sys
+import queue
+import shutil
 import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
 
 from PIL import Image, ImageTk
 
+from guimg.registry import AlgorithmRegistry
+from guimg.startup import ImportTimer, StartupTelemetry
+
+# start of the application, the startup telemetry is measured from here
+STARTED = time.perf_counter()
+
 ALGORITHMS_DIRECTORY = "<SET YOUR PATH HERE>"
-# dict with { module_name: parent_directory } structure
-# NOTE: when adding algorithms make sure to include them here as well
-ALGORITHMS_MAP = {
-    'Adaptive_Histogram_Equalization': 'preprocessing',
-    'Histogram_Equalization': 'preprocessing',
-    'Zero_DCE': 'preprocessing',
-    'ame': 'quality_measures',
-    'BIE': 'quality_measures',
-    'mean_deviation': 'quality_measures',
-    'shannon_entropy': 'quality_measures',
-}
-
-# order in which the algorithms should run
-# NOTE: this gets sorted on category level,
-#       if you want to sort on function level as well, you need to modify the sorting logic in process_image
+
+# order in which the algorithm categories should run
+# NOTE: this gets sorted on category level, categories not listed here run after the listed ones in alphabetical order
+#       if you want to sort on function level as well, you need to modify the sorting logic in AlgorithmRegistry.sort
 PROCESSING_ORDER = ['preprocessing', 'quality_measures']
 
+# stage results are cached here across runs, so processing the same image again only runs the changed stages
+CACHE_DIRECTORY = os.path.join(os.getcwd(), "cache")
+# size limit of the cache, the least recently used results are removed beyond it
+CACHE_MAX_BYTES = 2 * 2 ** 30
+
+# how often the Tk main loop picks up the updates posted by worker threads, in milliseconds
+UI_POLL_INTERVAL = 50
+# size of the displayed images
+THUMBNAIL_SIZE = (300, 200)
+
+# import torch, cv2 and all algorithm packages on a background thread right after the window shows,
+# so the first processing doesn't pay for them
+PREWARM = True
+# startup milestones and the slowest imports of every session are appended here, to catch startup regressions
+TELEMETRY_FILE = os.path.join(os.getcwd(), "telemetry", "startup.jsonl")
+# profile the compute phase of every stage with 'cprofile' or 'sampling', None to only trace the stages
+# with 'cprofile' the stages run one after the other, only one cProfile profiler can be active at a time
+# every run writes tmp/trace.json (open it in chrome://tracing or ui.perfetto.dev) and the profiles to tmp/profiles/
+PROFILE = None
+
 
 class ImageProcessorApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Image Processor")
         self.root.state('zoomed')
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.telemetry = StartupTelemetry(TELEMETRY_FILE, STARTED)
+        # times the imports of the startup and the prewarming, uninstalled once prewarming is done
+        self.import_timer = ImportTimer().install()
+        # discovers the algorithm packages once and caches them after their first use
+        self.registry = AlgorithmRegistry(ALGORITHMS_DIRECTORY, PROCESSING_ORDER)
         # dict holding which algorithms have been checked by the user
         self.modules_map = {}
         # dict holding args/kwargs for each function
@@ -42,6 +64,14 @@ class ImageProcessorApp:
         self.current_function = None
         # to display images and tables in a grid
         self.image_grid_position = [0, 0]
+        # on-disk cache of stage results, created on first processing
+        self.cache = None
+        # widget updates posted by worker threads, run on the Tk main loop by drain_ui_queue
+        self.ui_queue = queue.Queue()
+        # table the numeric results of the current run are added to, created with the first result
+        self.results_tree = None
+        # the running job, see guimg.jobs.Job
+        self.job = None
 
         # START styling
 
@@ -83,21 +113,33 @@ class ImageProcessorApp:
 
         self.functions_frame = ttk.Frame(self.sidebar_frame, height=400, width=200)
         self.functions_frame.pack(pady=10, padx=10, fill='x')
-        # displays checkboxes based on packages in ALGORITHMS_DIRECTORY
-        self.populate_function_list(self.functions_frame)
+        # checkboxes for the packages in ALGORITHMS_DIRECTORY replace this once they are discovered, see prewarm
+        self.loading_label = ttk.Label(self.functions_frame, text="Loading algorithms...")
+        self.loading_label.pack()
 
         self.upload_button = ttk.Button(self.sidebar_frame, text="Upload Image",
-                                        command=lambda: self.thread_it(self.upload_image), cursor="hand2")
+                                        command=self.upload_image, cursor="hand2")
         self.upload_button.pack(pady=5)
 
         self.process_button = ttk.Button(self.sidebar_frame, text="Process Image",
-                                         command=lambda: self.thread_it(self.process_image), cursor="hand2")
+                                         command=self.start_processing, cursor="hand2")
         self.process_button.pack(pady=5)
 
         self.reset_button = ttk.Button(self.sidebar_frame, text="Reset",
-                                       command=lambda: self.thread_it(self.reset), cursor="hand2")
+                                       command=self.reset, cursor="hand2")
         self.reset_button.pack(pady=5)
 
+        self.cancel_button = ttk.Button(self.sidebar_frame, text="Cancel",
+                                        command=self.cancel_processing, cursor="hand2")
+        self.cancel_button.state(['disabled'])
+        self.cancel_button.pack(pady=5)
+
+        # progress of the running job, the label names the stage it is in
+        self.progress_bar = ttk.Progressbar(self.sidebar_frame, maximum=1.0, length=180)
+        self.progress_bar.pack(pady=5, padx=10)
+        self.progress_label = ttk.Label(self.sidebar_frame, text="")
+        self.progress_label.pack()
+
         # input is shown when a function is selected
         self.input_frame = ttk.Frame(self.root)
         self.input_frame.pack(side='top', fill='x', pady=10)
@@ -122,18 +164,70 @@ class ImageProcessorApp:
 
         # END init layout
 
+        self.root.after(UI_POLL_INTERVAL, self.drain_ui_queue)
+        self.root.after_idle(self.telemetry.mark, 'window_shown')
+        # the window shows right away, the algorithms are discovered and imported in the background
+        self.thread_it(self.prewarm)
+
     def thread_it(self, func, *args):
         """ Packing functions into threads """
         threading.Thread(target=func, args=args, daemon=True).start()
 
+    def prewarm(self):
+        """ Runs on a worker thread at startup: lists the algorithms, then imports the heavy libraries and packages """
+        from guimg.startup import prewarm
+
+        try:
+            # scans the algorithms directory, the checkboxes are created on the UI thread
+            try:
+                self.registry.categories()
+            except Exception as e:
+                # otherwise the error would die with this thread and the sidebar would keep saying loading
+                self.post(self.show_loading_error, e)
+                return
+            self.post(self.show_function_list)
+            if PREWARM:
+                prewarm(self.registry, self.telemetry)
+            self.telemetry.mark('prewarmed')
+        finally:
+            self.import_timer.uninstall()
+
+    def show_function_list(self):
+        self.loading_label.destroy()
+        # displays checkboxes based on packages in ALGORITHMS_DIRECTORY
+        self.populate_function_list(self.functions_frame)
+        self.telemetry.mark('interactive')
+
+    def show_loading_error(self, error):
+        self.loading_label.config(text="Could not load the algorithms")
+        messagebox.showerror("Error", f"Could not load the algorithms from {ALGORITHMS_DIRECTORY}:\n"
+                                      f"{type(error).__name__}: {error}")
+
+    def on_close(self):
+        try:
+            self.telemetry.write(self.import_timer)
+        except OSError as e:
+            print(f'could not write the startup telemetry: {e}')
+        self.root.destroy()
+
+    def post(self, func, *args):
+        """ Runs func(*args) on the Tk main loop, worker threads must not create or change widgets themselves """
+        self.ui_queue.put((func, args))
+
+    def drain_ui_queue(self):
+        """ Runs the updates posted by worker threads, rescheduled every UI_POLL_INTERVAL ms """
+        try:
+            while True:
+                func, args = self.ui_queue.get_nowait()
+                func(*args)
+        except queue.Empty:
+            pass
+        finally:
+            self.root.after(UI_POLL_INTERVAL, self.drain_ui_queue)
+
     def reset(self):
         # remove everything from tmp folder
-        tmp_dir = os.path.join(os.getcwd(), "tmp")
-        if os.path.exists(tmp_dir):
-            for file in os.listdir(tmp_dir):
-                file_path = os.path.join(tmp_dir, file)
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
+        self.clear_tmp()
 
         # do not display any images or tables
         for widget in self.image_frame.winfo_children():
@@ -141,6 +235,7 @@ class ImageProcessorApp:
 
         # unset grid position
         self.image_grid_position = [0, 0]
+        self.results_tree = None
 
         # uncheck the checked in modules map
         for module in self.modules_map:
@@ -151,44 +246,72 @@ class ImageProcessorApp:
         self.json_input_field.delete(0, tk.END)
         self.json_input_field.insert(0, json.dumps({"args": [], "kwargs": {}}))
 
+    @staticmethod
+    def clear_tmp():
+        tmp_dir = os.path.join(os.getcwd(), "tmp")
+        if os.path.exists(tmp_dir):
+            for file in os.listdir(tmp_dir):
+                file_path = os.path.join(tmp_dir, file)
+                if os.path.isfile(file_path):
+                    os.unlink(file_path)
+                elif os.path.isdir(file_path):
+                    # e.g. the profiles and the output of a video
+                    shutil.rmtree(file_path)
+
     def upload_image(self):
-        file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.png *.jpg *.jpeg")])
+        from guimg.stream import VIDEO_EXTENSIONS
+        from guimg.tiled import TILED_EXTENSIONS
+
+        # the dialog runs on the UI thread, copying and displaying the image on a worker
+        file_path = filedialog.askopenfilename(filetypes=[
+            ("Image files", "*.png *.jpg *.jpeg"), ("Video files", " ".join(f"*{ext}" for ext in VIDEO_EXTENSIONS)),
+            ("Large images", " ".join(f"*{ext}" for ext in TILED_EXTENSIONS))])
         if file_path:
-            tmp_dir = os.path.join(os.getcwd(), "tmp")
-            os.makedirs(tmp_dir, exist_ok=True)
-            tmp_file_path = os.path.join(tmp_dir, os.path.basename(file_path))
-            with open(file_path, "rb") as f_src:
-                with open(tmp_file_path, "wb") as f_dest:
-                    f_dest.write(f_src.read())
-            self.display_image(tmp_file_path, "Original")
+            self.thread_it(self.copy_uploaded_image, file_path)
+
+    def copy_uploaded_image(self, file_path):
+        from guimg.imaging import convert
+        from guimg.stream import VIDEO_EXTENSIONS, FrameSource
+
+        tmp_dir = os.path.join(os.getcwd(), "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_file_path = os.path.join(tmp_dir, os.path.basename(file_path))
+        # a copy, never a link, so nothing written to tmp/ can reach the user's file; an entry left from before
+        # is unlinked rather than overwritten. Copied in the kernel (sendfile), not read into memory whole
+        if os.path.lexists(tmp_file_path):
+            os.unlink(tmp_file_path)
+        shutil.copyfile(file_path, tmp_file_path)
+        # uploads are single files, names like scan[1].png or 50%.jpg are no sequence patterns
+        if tmp_file_path.lower().endswith(VIDEO_EXTENSIONS):
+            # videos are shown by their first frame
+            frame = next(iter(FrameSource(tmp_file_path, sequence=False)), None)
+            if frame is not None:
+                self.display_image(convert(frame, 'pil'), "Original (first frame)")
+            return
+        self.display_image(tmp_file_path, "Original")
 
     def populate_function_list(self, parent_frame):
         """ Helper to display function names with checkboxes in the sidebar """
-        # loop through algorithms directory: this returns first level subdirectories (preprocessing, etc.)
-        for dir_name in os.listdir(ALGORITHMS_DIRECTORY):
-            dir_path = os.path.join(ALGORITHMS_DIRECTORY, dir_name)
-            if os.path.isdir(dir_path):
-                # the section that will hold checkboxes for current subdirectory
-                section_frame = ttk.LabelFrame(parent_frame, text=dir_name, height=10, width=10)
-                # fill the current section with checkboxes
-                self._populate_checkboxes(section_frame, dir_path)
-                section_frame.pack(fill="both", expand='yes', pady=10, anchor="w")
-
-    def _populate_checkboxes(self, parent_frame, dir_path):
+        # one section per category (preprocessing, etc.) found in the algorithms directory
+        for category, names in self.registry.categories().items():
+            # the section that will hold checkboxes for current category
+            section_frame = ttk.LabelFrame(parent_frame, text=category, height=10, width=10)
+            # fill the current section with checkboxes
+            self._populate_checkboxes(section_frame, names)
+            section_frame.pack(fill="both", expand='yes', pady=10, anchor="w")
+
+    def _populate_checkboxes(self, parent_frame, names):
         """ Helper to display checkboxes for each category """
-        for sub_dir in os.listdir(dir_path):
-            # check if sub_dir is a python package
-            if os.path.isdir(sub_dir_path := os.path.join(dir_path, sub_dir)) and "__init__.py" in os.listdir(
-                    sub_dir_path):
-                # create the checkbox
-                var = tk.BooleanVar()
-                chk = ttk.Checkbutton(parent_frame, text=sub_dir, variable=var, cursor="hand2")
-                chk.pack(anchor="w")
-                # store the checkbox variable in modules_map for later reference
-                self.modules_map[sub_dir] = var
-                # add an event listener to trigger args/kwargs input on check/uncheck
-                var.trace_add('write',
-                              lambda *args, name=sub_dir, var=var: self.on_function_select(name, var))
+        for name in names:
+            # create the checkbox
+            var = tk.BooleanVar()
+            chk = ttk.Checkbutton(parent_frame, text=name, variable=var, cursor="hand2")
+            chk.pack(anchor="w")
+            # store the checkbox variable in modules_map for later reference
+            self.modules_map[name] = var
+            # add an event listener to trigger args/kwargs input on check/uncheck
+            var.trace_add('write',
+                          lambda *args, name=name, var=var: self.on_function_select(name, var))
 
     def on_function_select(self, name, var):
         """ Event listener for function checkboxes """
@@ -221,121 +344,229 @@ class ImageProcessorApp:
             parsed_args = json.loads(args_input)
             self.function_args[self.current_function] = parsed_args
 
-    def process_image(self):
-        """ Apply selected algorithms to the uploaded image """
-        import cv2
-        import numpy as np
-        import torch
-        import torchvision.utils
-
-        print('processing the image...')
+    def start_processing(self):
+        """ Reads the selection on the UI thread and processes the image on a worker thread """
+        # get the functions which need to be executed, they get sorted by processing order in linear_graph
+        selected_modules = [key for key, selected in self.modules_map.items() if selected.get()]
+        self.process_button.state(['disabled'])
+        self.cancel_button.state(['!disabled'])
+        # a new table for the numeric results of this run
+        self.results_tree = None
+
+        from guimg.jobs import Job
+        self.job = Job(on_progress=lambda fraction, module_name: self.post(self.show_progress, fraction, module_name))
+        self.show_progress(0.0, "")
+        self.thread_it(self.process_image, self.job, selected_modules, dict(self.function_args),
+                       self.pipeline_var.get())
+
+    def cancel_processing(self):
+        """ Stops the running job at its next checkpoint, the results so far stay displayed """
+        if self.job is not None:
+            self.job.cancel()
+            self.cancel_button.state(['disabled'])
+
+    def show_progress(self, fraction, module_name):
+        self.progress_bar['value'] = fraction
+        self.progress_label.config(text=module_name)
+
+    def finish_processing(self, status):
+        self.process_button.state(['!disabled'])
+        self.cancel_button.state(['disabled'])
+        self.progress_label.config(text=status)
+        self.job = None
+
+    @staticmethod
+    def format_stage_stats(stats):
+        """ One line summary of where the time and memory of a stage went, see guimg.jobs.Job.stage """
+        if stats.get("cached"):
+            return f"cached, {stats['wall']:.2f}s"
+        if stats.get("overlapped"):
+            # process wide figures, other stages ran at the same time
+            return f"{stats['wall']:.2f}s wall, {stats['cpu']:.2f}s CPU incl. parallel stages"
+        text = f"{stats['wall']:.2f}s wall, {stats['cpu']:.2f}s CPU"
+        if stats.get("peak_rss") is not None:
+            text += f", {stats['peak_rss'] / 2 ** 20:.0f} MB peak"
+        return text
+
+    def process_image(self, job, selected_modules, function_args, pipeline):
+        """ Apply selected algorithms to the uploaded image, runs on a worker thread
+
+        Every result is posted to the UI thread as soon as its stage finishes.
+        """
+        from guimg.cache import ResultCache
+        from guimg.graph import linear_graph, run_graph
+        from guimg.imaging import save_image
+        from guimg.instrumentation import Tracer
+        from guimg.jobs import Cancelled
+        from guimg.pipeline import UnexpectedResultError
+        from guimg.stream import VIDEO_EXTENSIONS
+        from guimg.sweep import Sweep, is_sweep
+        from guimg.tiled import TILED_EXTENSIONS
+
+        status = "failed"
+        tracer = Tracer(profile=PROFILE)
         tmp_dir = os.path.join(os.getcwd(), "tmp")
-        # get the uploaded image
-        image_path = next(
-            (os.path.join(tmp_dir, f) for f in os.listdir(tmp_dir) if f.endswith(('.png', '.jpg', '.jpeg'))), None)
-
-        if not image_path:
-            messagebox.showerror("Error", "No image uploaded.")
-            return
-
-        # add ALGORITHMS_DIRECTORY to sys path, so the imports in modules work
-        parent_dir = os.path.dirname(ALGORITHMS_DIRECTORY)
-        if parent_dir not in sys.path:
-            sys.path.insert(0, parent_dir)
+        try:
+            print('processing the image...')
+            # get the uploaded image
+            image_path = next((os.path.join(tmp_dir, f) for f in os.listdir(tmp_dir)
+                               if f.lower().endswith(('.png', '.jpg', '.jpeg') + VIDEO_EXTENSIONS + TILED_EXTENSIONS)),
+                              None) if os.path.isdir(tmp_dir) else None
+
+            if not image_path:
+                self.post(messagebox.showerror, "Error", "No image uploaded.")
+                return
+            if image_path.lower().endswith(VIDEO_EXTENSIONS):
+                status = self.process_video(job, image_path, selected_modules, function_args, pipeline)
+                return
 
-        # get the functions which need to be executed
-        selected_modules = [key for key, selected in self.modules_map.items() if selected.get()]
-        # sort the functions by processing order
-        sorted_modules = sorted(selected_modules, key=lambda x: PROCESSING_ORDER.index(ALGORITHMS_MAP[x]))
-
-        # doct for the numeric results(quality_measures)
-        results = {}
-
-        for module_name in sorted_modules:
-            print(f'performing {module_name}...')
-            # get the package
-            module_dir = os.path.join(ALGORITHMS_DIRECTORY, ALGORITHMS_MAP[module_name], module_name)
-            # load the main function of the package
-            spec = importlib.util.spec_from_file_location('main', os.path.join(module_dir, '__init__.py'))
-            # import the package
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            # check if there should be any args/kwargs passed to this function
-            func_args = self.function_args.get(module_name, {})
-            args = func_args.get('args', [])
-            kwargs = func_args.get('kwargs', {})
-
-            # execute the main function
-            result = module.main(image_path, *args, **kwargs)
-
-            # numeric results -> store in results dict
-            if isinstance(result, (int, float, np.floating)):
-                results[module_name] = float(result)
-            elif isinstance(result, torch.Tensor):
-                # save the image with its algorithm name
-                result_path = os.path.join(tmp_dir, f"{module_name}.png")
-                torchvision.utils.save_image(result, result_path)
-                # check if running in a pipeline is checked
-                if self.pipeline_var.get():
-                    # update the image_path so the next function gets the result of this function as input
-                    image_path = result_path
-                # display the result with it's label as module_name
-                self.display_image(result_path, module_name)
-            elif isinstance(result, np.ndarray):
-                # save the image with its algorithm name
-                result_path = os.path.join(tmp_dir, f"{module_name}.png")
-                cv2.imwrite(result_path, result)
-                # check if running in a pipeline is checked
-                if self.pipeline_var.get():
-                    # update the image_path so the next function gets the result of this function as input
-                    image_path = result_path
-                # display the result with it's label as module_name
-                self.display_image(result_path, module_name)
+            def on_image(module_name, image):
+                self.telemetry.mark('first_result')
+                title = f"{module_name}\n{self.format_stage_stats(job.stats(module_name))}"
+                if image.has('tiled'):
+                    # large images are exported as .npy band by band and shown from a sampled preview
+                    self.thread_it(image.get('tiled').save, os.path.join(tmp_dir, f"{module_name}.npy"))
+                    self.display_image(image.get('tiled'), title)
+                    return
+                # export the image with its algorithm name, off the critical path
+                self.thread_it(save_image, image.get('bgr'), os.path.join(tmp_dir, f"{module_name}.png"))
+                # display the result with it's label as module_name and the stats of its stage below it
+                self.display_image(image.get('pil'), title)
+
+            def on_result(module_name, value):
+                self.telemetry.mark('first_result')
+                self.post(self.add_result, module_name, value, self.format_stage_stats(job.stats(module_name)))
+
+            if self.cache is None:
+                self.cache = ResultCache(CACHE_DIRECTORY, CACHE_MAX_BYTES)
+            hits, misses = self.cache.hits, self.cache.misses
+
+            # independent stages, e.g. the quality measures, run at the same time
+            if is_sweep(function_args):
+                # every combination of the swept values, stages the combinations have in common run once
+                sweep = Sweep(self.registry, selected_modules, function_args, pipeline)
+                nodes = sweep.nodes
             else:
-                # unexpected type was returned from the main function of current module
-                messagebox.showerror("Error", f"Unexpected result type from module {module_name}")
-                print(type(result))
+                sweep = None
+                nodes = linear_graph(self.registry, selected_modules, function_args, pipeline)
+            started = time.perf_counter()
+            try:
+                results = run_graph(self.registry, image_path, nodes, on_image=on_image, on_result=on_result,
+                                    cache=self.cache, job=job, tracer=tracer)
+            except Cancelled as e:
+                status = f"cancelled in {e}"
+                return
+            except UnexpectedResultError as e:
+                # unexpected type was returned from the main function of a module
+                self.post(messagebox.showerror, "Error", str(e))
                 return
-            print(f'finished {module_name}')
-
-        # if there are numeric results
-        if results:
-            # save json to tmp
-            results_path = os.path.join(tmp_dir, "results.json")
-            with open(results_path, "w") as f:
-                json.dump(results, f)
-
-            # display the table
-            self.display_results_table(results_path)
-
-        messagebox.showinfo("Processing Complete", "Image processing is complete.")
-
-    def display_image(self, image_path, title):
-        img = Image.open(image_path)
-        img = img.resize((300, 200), Image.LANCZOS)
-        img = ImageTk.PhotoImage(img)
 
+            # if there are numeric results, export json to tmp
+            if results:
+                self.save_results(results, os.path.join(tmp_dir, "results.json"))
+            if sweep is not None:
+                sweep.write_csv(os.path.join(tmp_dir, "sweep.csv"), results)
+                self.post(self.display_sweep_table, *sweep.table(results))
+
+            status = f"done in {time.perf_counter() - started:.2f}s"
+            self.post(messagebox.showinfo, "Processing Complete",
+                      f"Image processing is complete.\n{self.cache.hits - hits} stages reused from the cache, "
+                      f"{self.cache.misses - misses} computed.")
+        finally:
+            if tracer.events:
+                tracer.write_chrome_trace(os.path.join(tmp_dir, "trace.json"))
+                tracer.write_profiles(os.path.join(tmp_dir, "profiles"))
+            self.post(self.finish_processing, status)
+
+    def process_video(self, job, video_path, selected_modules, function_args, pipeline):
+        """ Streams the frames of the uploaded video through the selected algorithms, runs on a worker thread
+
+        The enhanced video and the per frame results of the quality measures are written to tmp/output.
+
+        Returns:
+            : the status shown below the progress bar
+        """
+        from guimg.jobs import Cancelled
+        from guimg.stream import FrameSource, process_stream
+
+        output_dir = os.path.join(os.path.dirname(video_path), "output")
+        source = FrameSource(video_path, sequence=False)
+
+        def on_frame(index, results):
+            if source.frame_count:
+                self.post(self.show_progress, (index + 1) / source.frame_count, f"frame {index + 1}")
+
+        try:
+            report = process_stream(self.registry, source, selected_modules, function_args, pipeline,
+                                    output_video=os.path.join(output_dir, "enhanced.mp4"),
+                                    metrics_csv=os.path.join(output_dir, "metrics.csv"), on_frame=on_frame, job=job)
+        except Cancelled:
+            return "cancelled"
+        stages = "\n".join(f"{name}: {stats['fps']} fps" for name, stats in report["stages"].items())
+        self.post(messagebox.showinfo, "Processing Complete",
+                  f"Processed {report['frames']} frames at {report['fps']} fps.\n{stages}\n"
+                  f"The enhanced video and the metrics are in {output_dir}.")
+        return f"done in {report['seconds']:.2f}s"
+
+    @staticmethod
+    def save_results(results, results_path):
+        with open(results_path, "w") as f:
+            json.dump(results, f)
+
+    @staticmethod
+    def make_thumbnail(image):
+        """ Opens and scales an image given as a path, a PIL image or a TiledImage for display,
+        the slow part of displaying it """
+        from guimg.imaging import convert
+        from guimg.tiled import TILED_EXTENSIONS, TiledImage, open_tiled
+
+        if isinstance(image, str) and image.lower().endswith(TILED_EXTENSIONS):
+            # memory-mapped files are sampled instead of decoded, TIFFs tifffile can't map are opened by PIL
+            image = open_tiled(image) or image
+        if isinstance(image, TiledImage):
+            image = convert(image.thumbnail(max(THUMBNAIL_SIZE)), 'pil')
+        img = Image.open(image) if isinstance(image, str) else image
+        return img.resize(THUMBNAIL_SIZE, Image.LANCZOS)
+
+    def display_image(self, image, title):
+        """ Displays an image given as a path, a PIL image or a TiledImage,
+        the thumbnail is made on the calling (worker) thread """
+        self.post(self.place_image, self.make_thumbnail(image), title)
+
+    def next_grid_position(self):
+        """ Returns the grid cell for the next image or table and advances the position """
         row, col = self.image_grid_position
-        panel = ttk.Label(self.image_frame, text=title, image=img, compound='top')
-        panel.image = img
-        panel.grid(row=row, column=col, padx=10, pady=10)
-
         # update grid position
         if col == 2:
             self.image_grid_position = [row + 1, 0]
         else:
             self.image_grid_position = [row, col + 1]
+        return row, col
 
-    def display_results_table(self, results_path):
-        with open(results_path, "r") as f:
-            results = json.load(f)
+    def place_image(self, thumbnail, title):
+        img = ImageTk.PhotoImage(thumbnail)
 
-        row, col = self.image_grid_position
-        tree = ttk.Treeview(self.image_frame, columns=("Algorithm", "Value"), show='headings', height=6,
+        row, col = self.next_grid_position()
+        panel = ttk.Label(self.image_frame, text=title, image=img, compound='top')
+        panel.image = img
+        panel.grid(row=row, column=col, padx=10, pady=10)
+
+    def add_result(self, algorithm, value, stage_stats=""):
+        """ Adds a row to the results table of the current run, the table is created with the first row """
+        if self.results_tree is None:
+            self.results_tree = self.display_results_table({})
+        idx = len(self.results_tree.get_children())
+        row_tag = 'oddrow' if idx % 2 == 0 else 'evenrow'
+        self.results_tree.insert("", "end", values=(algorithm, value, stage_stats), tags=(row_tag,))
+
+    def display_results_table(self, results):
+        row, col = self.next_grid_position()
+        tree = ttk.Treeview(self.image_frame, columns=("Algorithm", "Value", "Stage"), show='headings', height=6,
                             style="Custom.Treeview")
 
         tree.heading("Algorithm", text="Algorithm")
         tree.heading("Value", text="Value")
+        tree.heading("Stage", text="Time / memory")
 
         tree.tag_configure('oddrow', background='white', foreground='black')
         tree.tag_configure('evenrow', background='#f2f2f2', foreground='black')
@@ -344,12 +575,26 @@ class ImageProcessorApp:
             row_tag = 'oddrow' if idx % 2 == 0 else 'evenrow'
             tree.insert("", "end", values=(algorithm, value), tags=(row_tag,))
         tree.grid(row=row, column=col, padx=10, pady=10)
+        return tree
 
-        # update grid position
-        if col == 2:
-            self.image_grid_position = [row + 1, 0]
-        else:
-            self.image_grid_position = [row, col + 1]
+    def display_sweep_table(self, columns, rows):
+        """ Table with the swept values and the numeric results of every point of a sweep """
+        row, col = self.next_grid_position()
+        tree = ttk.Treeview(self.image_frame, columns=columns, show='headings', height=10, style="Custom.Treeview")
+        for column in columns:
+            tree.heading(column, text=column)
+            tree.column(column, width=90, anchor='e')
+
+        tree.tag_configure('oddrow', background='white', foreground='black')
+        tree.tag_configure('evenrow', background='#f2f2f2', foreground='black')
+
+        for idx, point in enumerate(rows):
+            row_tag = 'oddrow' if idx % 2 == 0 else 'evenrow'
+            values = [f"{point[column]:.6g}" if isinstance(point[column], float) else point[column]
+                      for column in columns]
+            tree.insert("", "end", values=values, tags=(row_tag,))
+        tree.grid(row=row, column=col, padx=10, pady=10)
+        return tree
 
 
 if __name__ == "__main__":
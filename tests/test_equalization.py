@@ -0,0 +1,75 @@
+""" The LUT based equalizers (algorithms/common/equalization.py and the AHE package) against the former
+per pixel and per tile implementations
+"""
+import cv2
+import numpy as np
+import pytest
+
+from algorithms.common.equalization import hist_equalization
+from algorithms.preprocessing import Histogram_Equalization
+from algorithms.preprocessing.Adaptive_Histogram_Equalization import ahe
+from guimg.tiled import TiledImage
+
+# (height, width) of the checked images, including sizes that aren't a multiple of the AHE tiles
+SIZES = [(1, 1), (7, 13), (185, 136), (200, 150), (481, 640)]
+
+
+def hist_equalization_per_pixel(img):
+    """ The implementation hist_equalization replaced, kept as the reference """
+    array = np.asarray(img)
+    bin_cont = np.bincount(array.flatten(), minlength=256)
+    pixels = np.sum(bin_cont)
+    bin_cont = bin_cont / pixels
+    cumulative_sumhist = np.cumsum(bin_cont)
+    map = np.floor(255 * cumulative_sumhist).astype(np.uint8)
+    arr_list = list(array.flatten())
+    eq_arr = [map[p] for p in arr_list]
+    return np.reshape(np.asarray(eq_arr), array.shape)
+
+
+def ahe_per_tile(img, rx=136, ry=185):
+    """ The AHE the tile parallel engine replaced, kept as the reference for interpolate=False """
+    img_eq = np.empty((img.shape[0], img.shape[1]), dtype=np.uint8)
+    for i in range(0, img.shape[1], rx):
+        for j in range(0, img.shape[0], ry):
+            img_eq[j:j + ry, i:i + rx] = hist_equalization_per_pixel(img[j:j + ry, i:i + rx])
+    return img_eq
+
+
+def low_light_channel(height, width):
+    # most of the pixels are dark, as in the images the equalizers are used on
+    rng = np.random.default_rng(height * 1000 + width)
+    return (rng.random((height, width)) ** 3 * 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('height, width', SIZES)
+def test_hist_equalization_matches_per_pixel(height, width):
+    channel = low_light_channel(height, width)
+    result = hist_equalization(channel)
+    reference = hist_equalization_per_pixel(channel)
+    np.testing.assert_array_equal(result, reference)
+    assert result.dtype == reference.dtype
+
+
+@pytest.mark.parametrize('rx, ry', [(136, 185), (16, 16), (50, 7)])
+@pytest.mark.parametrize('height, width', SIZES)
+def test_ahe_without_interpolation_matches_per_tile(height, width, rx, ry):
+    channel = low_light_channel(height, width)
+    np.testing.assert_array_equal(ahe(channel, rx, ry, interpolate=False, workers=2), ahe_per_tile(channel, rx, ry))
+
+
+@pytest.mark.parametrize('height, width', SIZES)
+def test_ahe_with_interpolation_keeps_the_shape(height, width):
+    result = ahe(low_light_channel(height, width), 16, 16)
+    assert result.shape == (height, width) and result.dtype == np.uint8
+
+
+@pytest.mark.parametrize('height, width', [(7, 13), (481, 640)])
+def test_tiled_histogram_equalization_matches_whole_image(height, width, monkeypatch):
+    # bands of a few rows, so the image is equalized in many of them
+    bands = TiledImage.bands
+    monkeypatch.setattr(TiledImage, 'bands', lambda self, multiple=1, max_bytes=None: bands(self, multiple, 4096))
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    image[..., 2] //= 4
+    tiled = Histogram_Equalization.main(TiledImage.from_array(image))
+    np.testing.assert_array_equal(tiled.to_array(), Histogram_Equalization.main(image))
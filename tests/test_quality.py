@@ -0,0 +1,121 @@
+""" The shared quality measure engine (algorithms/common/quality.py) against the former per block implementations
+
+Covers images smaller than one block, sizes that aren't a multiple of the block size and the band by band
+statistics of a TiledImage against those of the whole image.
+"""
+import warnings
+
+import cv2
+import numpy as np
+import pytest
+
+from algorithms.common import quality
+from guimg.tiled import TiledImage
+
+# (height, width) of the checked images, the first ones are smaller than a block in one or both dimensions
+SIZES = [(1, 1), (10, 12), (14, 200), (200, 9), (15, 15), (100, 137), (481, 640)]
+BLOCK_SIZES = (7, 15)
+# small enough to split every image but the smallest into several bands
+BAND_BYTES = 4096
+
+
+def shannon_entropy_per_block(image):
+    """ The shannon_entropy the measures replaced, kept as the reference """
+    if len(image.shape) == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    hist = cv2.calcHist([image], [0], None, [256], [0, 256])
+    hist = hist.ravel() / hist.sum()
+    return -np.sum(hist * np.log2(hist + 1e-10))
+
+
+def ame_per_block(image, block_size=15, epsilon=1e-6, modified=False):
+    """ The AME the measures replaced, kept as the reference """
+    metric_values = []
+    image = image.astype(np.float32)
+    height, width = image.shape
+    for i in range(0, height, block_size):
+        for j in range(0, width, block_size):
+            block = image[i:i + block_size, j:j + block_size]
+            Imin = np.min(block)
+            Imax = np.max(block)
+            if modified:
+                A = epsilon + (Imax - Imin) / 255
+            else:
+                A = epsilon + (Imax - Imin) / (Imax + Imin + epsilon)
+            metric_values.append(A * np.log(A))
+    return np.abs(np.nanmean(metric_values))
+
+
+def bie_per_block(image, block_size=15):
+    """ The BIE the measures replaced, kept as the reference, NaN for images without a whole block """
+    block_entropies = []
+    block_contrasts = []
+    for i in range(image.shape[0] // block_size):
+        for j in range(image.shape[1] // block_size):
+            block = image[i * block_size:(i + 1) * block_size, j * block_size:(j + 1) * block_size]
+            block_entropies.append(shannon_entropy_per_block(block))
+            block_contrasts.append(np.std(block))
+    mean_block_entropy = np.mean(block_entropies)
+    image_entropy = ame_per_block(image, block_size, modified=True)
+    m = 1 - np.abs(np.mean(image) - 128) / 128
+    p = m * np.std(image) / (np.mean(block_contrasts) + 1)
+    return p * image_entropy / (1 + mean_block_entropy)
+
+
+def random_image(height, width):
+    return np.random.default_rng(height * 1000 + width).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def statistics_of(image, kind):
+    if kind == 'tiled':
+        return quality.TiledStatistics(TiledImage.from_array(image), BAND_BYTES)
+    return quality.ImageStatistics(image)
+
+
+@pytest.fixture(autouse=True)
+def ignore_empty_means():
+    # the mean of no blocks is expected for images without a whole block, it gives NaN as before
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        yield
+
+
+@pytest.mark.parametrize('kind', ['memory', 'tiled'])
+@pytest.mark.parametrize('block_size', BLOCK_SIZES)
+@pytest.mark.parametrize('height, width', SIZES)
+def test_block_measures_match_per_block(height, width, block_size, kind):
+    image = random_image(height, width)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    statistics = statistics_of(image, kind)
+    assert quality.ame(statistics, block_size) == pytest.approx(ame_per_block(gray, block_size), rel=1e-6)
+    assert quality.ame(statistics, block_size, modified=True) == pytest.approx(
+        ame_per_block(gray, block_size, modified=True), rel=1e-6)
+    assert quality.bie(statistics, block_size) == pytest.approx(bie_per_block(gray, block_size), rel=1e-6,
+                                                                nan_ok=True)
+
+
+@pytest.mark.parametrize('kind', ['memory', 'tiled'])
+@pytest.mark.parametrize('height, width', SIZES)
+def test_global_measures_match_whole_image(height, width, kind):
+    image = random_image(height, width)
+    statistics = statistics_of(image, kind)
+    assert quality.shannon_entropy(statistics) == pytest.approx(shannon_entropy_per_block(image), rel=1e-6)
+    assert quality.mean_deviation(statistics) == pytest.approx(1 - np.abs(np.mean(image) - 128) / 128, rel=1e-6)
+
+
+@pytest.mark.parametrize('kind', ['memory', 'tiled'])
+@pytest.mark.parametrize('height, width', [(1, 1), (14, 200), (200, 9)])
+def test_bie_is_nan_without_a_whole_block(height, width, kind):
+    assert np.isnan(quality.bie(statistics_of(random_image(height, width), kind), 15))
+
+
+@pytest.mark.parametrize('block_size', BLOCK_SIZES)
+@pytest.mark.parametrize('height, width', SIZES)
+def test_tiled_statistics_match_whole_image(height, width, block_size):
+    image = random_image(height, width)
+    whole = quality.ImageStatistics(image)
+    tiled = statistics_of(image, 'tiled')
+    for name in ('block_min', 'block_max', 'block_std', 'block_entropies'):
+        np.testing.assert_allclose(getattr(tiled, name)(block_size), getattr(whole, name)(block_size), rtol=1e-6)
+    np.testing.assert_array_equal(tiled.histogram(), whole.histogram())
+    assert tiled.std() == pytest.approx(whole.std(), rel=1e-9)